@@ -1,30 +1,52 @@
-import random
+from collections import deque
 
-from .util import sign
+from .pathfinding import find_path, NEIGHBOURS, SEARCH_LIMIT
+from .scheduler import turn_delay
+
+# Shared by every AI that isn't following a path, which is most of them.
+NO_PATH = ()
+
+# Cells a player's travel may search. Players only travel to cells they can
+# see, which are rarely further than that from a path.
+TRAVEL_SEARCH_LIMIT = 1000
 
 class AI:
+    __slots__ = ("entity", "queued_path", "path_goal", "path_version")
+
+    search_limit = SEARCH_LIMIT
+
     def __init__(self, entity):
         self.entity = entity
-        self.queued_path = []
+        self.queued_path = NO_PATH
+        self.path_goal = None
+        self.path_version = None
 
     def think(self):
         if self.queued_path:
-            x, y = self.queued_path.pop(0)
-            self.move(x - self.entity.x, y - self.entity.y)
+            x, y = self.queued_path[0]
+            dx, dy = x - self.entity.x, y - self.entity.y
+
+            # Replan if the map changed or we were pushed off the path.
+            if self.path_version != self.entity.world.version \
+               or not self.entity.is_in_movement_range(dx, dy):
+                self.move_to(*self.path_goal)
+
+        if self.queued_path:
+            x, y = self.queued_path.popleft()
+            self.entity.queue_move(x - self.entity.x, y - self.entity.y)
 
     def move(self, dx, dy):
         self.entity.queue_move(dx, dy)
 
     def move_to(self, x, y):
-        self.queued_path = []
+        world = self.entity.world
 
-        at = [self.entity.x, self.entity.y]
+        self.path_goal = (x, y)
+        self.path_version = world.version
 
-        while at != [x, y]:
-            at[0] += sign(x - at[0])
-            at[1] += sign(y - at[1])
-
-            self.queued_path.append((*at,))
+        path = find_path(world, (self.entity.x, self.entity.y), (x, y),
+                         self.search_limit)
+        self.queued_path = deque(path) if path else NO_PATH
 
     def is_enemy(self, entity):
         return isinstance(entity.ai, ControlledAI)
@@ -34,22 +56,91 @@ class AI:
             self.move_to(entity.x, entity.y)
 
 class ControlledAI(AI):
-    def think(self):
-        pass
+    __slots__ = ()
+
+    search_limit = TRAVEL_SEARCH_LIMIT
+
+    # Moves and travels are what players decide, so they are what the turn log
+    # records. The steps of a travel aren't: replaying the travel retraces them.
+    def move(self, dx, dy):
+        world = self.entity.world
+
+        if world.turn_log:
+            world.turn_log.record(world.time, "move", self.entity.id, dx, dy)
+
+        # Taking over by hand stops travelling.
+        self.queued_path = NO_PATH
+        super().move(dx, dy)
+
+    # Walks to the cell over the following turns, one step on each, until it's
+    # reached or the player moves by hand.
+    def travel(self, x, y):
+        world = self.entity.world
+
+        if world.turn_log:
+            world.turn_log.record(world.time, "travel", self.entity.id, x, y)
+
+        self.move_to(x, y)
 
     def is_enemy(self, entity):
         return not super().is_enemy(entity)
 
 class AggressiveAI(AI):
+    __slots__ = ("last_seen",)
+
+    def __init__(self, entity):
+        super().__init__(entity)
+        self.last_seen = None
+
     def think(self):
-        self.attack(self.find_closest_enemy())
-        super().think()
+        enemy = self.find_closest_enemy()
+
+        if enemy:
+            self.last_seen = (enemy.x, enemy.y)
+            self.chase(enemy)
+        else:
+            # Head to where the enemy was last seen.
+            if self.last_seen:
+                self.move_to(*self.last_seen)
+                self.last_seen = None
+
+            super().think()
+
         self.entity.turn_done = True
 
+    # Follows the flow field shared by every monster, falling back to a search
+    # of our own if the enemy is out of its reach.
+    def chase(self, enemy):
+        step = self.entity.world.get_flow_field().next_step(
+            self.entity.x, self.entity.y, self.is_blocked)
+
+        if step:
+            self.queued_path = NO_PATH
+            self.move(step[0] - self.entity.x, step[1] - self.entity.y)
+        else:
+            self.attack(enemy)
+            super().think()
+
+    def is_blocked(self, x, y):
+        for entity in self.entity.world.get_entities_at(x, y):
+            if not self.is_enemy(entity):
+                return True
+
+        return False
+
     def is_enemy(self, entity):
         return super().is_enemy(entity) and isinstance(entity.ai, ControlledAI)
 
     def find_closest_enemy(self):
+        world = self.entity.world
+
+        if world.store:
+            for entity in world.get_enemy_candidates(self.entity):
+                if self.entity.can_see(entity.x, entity.y):
+                    return entity
+
+            return None
+
         closest = None
 
         for entity in self.entity.get_visible_entities():
@@ -64,6 +155,9 @@ class AggressiveAI(AI):
         return closest
 
 class SpawnerAI(AI):
+    __slots__ = ("spawn_fun", "max_spawn", "spawn_cooldown", "spawned",
+                 "last_spawn_time")
+
     def __init__(self, entity, spawn_fun, max_spawn=5, spawn_cooldown=15):
         super().__init__(entity)
 
@@ -72,29 +166,44 @@ class SpawnerAI(AI):
         self.spawn_cooldown = spawn_cooldown
 
         self.spawned = []
-        self.turns_since_last_spawn = 0
+        # Kept as a world tick rather than a counter, so the cooldown keeps
+        # running while the spawner sleeps without it doing any work.
+        self.last_spawn_time = 0
 
-    def position(self, entity):
-        while True:
-            entity.x = self.entity.x + random.randint(-1, 1)
-            entity.y = self.entity.y + random.randint(-1, 1)
+    def adopt(self, entity):
+        self.spawned.append(entity)
+        entity.dead += lambda: self.disown(entity)
 
-            if not self.entity.world.is_occupied(entity.x, entity.y):
-                return
+    # Stops counting an entity that left the world without dying, which lets
+    # the spawner replace it.
+    def disown(self, entity):
+        if entity in self.spawned:
+            self.spawned.remove(entity)
+
+    # Cells around the spawner there is room to spawn in.
+    def free_cells(self):
+        world = self.entity.world
+        x, y = self.entity.x, self.entity.y
+
+        return [(x + dx, y + dy) for dx, dy in NEIGHBOURS
+                if not world.is_occupied(x + dx, y + dy)]
 
     def think(self):
-        if len(self.spawned) < self.max_spawn \
-           and self.turns_since_last_spawn >= self.spawn_cooldown:
-            entity = self.spawn_fun()
+        time = self.entity.world.time
+        cooldown = self.spawn_cooldown * turn_delay(self.entity.speed)
 
-            self.spawned.append(entity)
-            entity.added += lambda: self.position(entity)
-            entity.dead += lambda: self.spawned.remove(entity)
+        if len(self.spawned) < self.max_spawn \
+           and time - self.last_spawn_time >= cooldown:
+            # A walled in spawner tries again on its next turn.
+            cells = self.free_cells()
 
-            self.entity.world.add_entity(entity)
+            if cells:
+                entity = self.spawn_fun()
+                entity.x, entity.y = self.entity.world.random.choice(cells)
 
-            self.turns_since_last_spawn = 0
+                self.adopt(entity)
+                self.entity.world.add_entity(entity)
 
-        self.turns_since_last_spawn += 1
+                self.last_spawn_time = time
 
         self.entity.turn_done = True
@@ -0,0 +1,172 @@
+import time
+
+import numpy as np
+
+from .world import World, spawn_goblin, spawn_player
+from .mapgen import run_cellular_automata
+from .tiles import Wall
+
+SEED = 1
+
+# Players in benchmark worlds, which is what keeps their monsters awake.
+PLAYERS = 10
+
+# Seconds each benchmark keeps repeating for.
+MIN_TIME = 0.2
+
+# Fewest calls per benchmark. Ten updates give every entity of normal speed
+# one turn, since only a tenth of them are due in any one update.
+MIN_RUNS = 10
+
+# Times `fun' over repeated calls, returning the mean seconds per call.
+def measure(fun, min_time=MIN_TIME):
+    runs = 0
+    started = time.perf_counter()
+    stop = started + min_time
+
+    while runs < MIN_RUNS or time.perf_counter() < stop:
+        fun()
+        runs += 1
+
+    return (time.perf_counter() - started) / runs, runs
+
+def make_world(size, entities):
+    world = World(size, size, SEED)
+    world.generate()
+
+    for i in range(PLAYERS):
+        world.add_entity(spawn_player(f"Player{i}", "red"))
+
+    for i in range(entities):
+        world.add_entity(spawn_goblin())
+
+    return world
+
+# A goblin right next to a player, so that it has someone to look for.
+def find_hunter(world):
+    player = world.players[0]
+
+    for entity in world.entities:
+        if not world.is_player(entity) and entity.dist(player) <= 2:
+            return entity
+
+    hunter = spawn_goblin()
+    world.add_entity(hunter)
+
+    for dy in range(-1, 2):
+        for dx in range(-1, 2):
+            if not world.is_occupied(player.x + dx, player.y + dy):
+                hunter.set_position(player.x + dx, player.y + dy)
+                return hunter
+
+    return hunter
+
+# Benchmarks that only depend on the map size.
+def map_benchmarks(size):
+    world = World(size, size, SEED)
+    world.generate()
+
+    walls = np.random.default_rng(SEED).random((size, size)) <= 0.4
+
+    looker = spawn_player("Looker", "red")
+    world.add_entity(looker)
+
+    def can_see():
+        # Forget the memoized FOV, or only the first call would compute it.
+        looker.fov_key = None
+        looker.can_see(looker.x + 3, looker.y + 3)
+
+    wall = next(tile for tile in world.tile_types if isinstance(tile, Wall))
+    cells = [(x, y) for y in range(0, size, max(1, size // 32))
+             for x in range(0, size, max(1, size // 32))]
+
+    def wall_glyphs():
+        for x, y in cells:
+            wall.get_fancy_character(world, x, y)
+
+    return {
+        "generate": lambda: World(size, size, SEED).generate(),
+        "cellular_automata": lambda: run_cellular_automata(walls),
+        "can_see": can_see,
+        "wall_glyphs": wall_glyphs
+    }
+
+ENTITY_BENCHMARKS = ["get_renderable", "get_visible_entities",
+                     "find_closest_enemy", "update"]
+
+# Benchmarks that depend on both the map size and how many entities it holds.
+def entity_benchmarks(size, entities):
+    world = make_world(size, entities)
+    player = world.players[0]
+    hunter = find_hunter(world)
+
+    return {
+        "get_renderable": lambda: world.get_renderable(player),
+        "get_visible_entities": lambda: world.get_visible_entities(player),
+        "find_closest_enemy": hunter.ai.find_closest_enemy,
+        "update": world.update
+    }
+
+def key(name, size, entities=None):
+    if entities is None:
+        return f"{name}[{size}]"
+
+    return f"{name}[{size},{entities}]"
+
+# Runs every benchmark for every map size, and the entity ones for every
+# entity count that fills at most a quarter of the map. Returns a mapping of
+# benchmark keys to their results, calling `progress' with each as it's done.
+def run(sizes, entity_counts, only=None, min_time=MIN_TIME, progress=None):
+    results = {}
+
+    def record(name, size, entities, fun):
+        if only and name not in only:
+            return
+
+        seconds, runs = measure(fun, min_time)
+
+        result = {
+            "name": name,
+            "size": size,
+            "entities": entities,
+            "seconds": seconds,
+            "runs": runs
+        }
+
+        results[key(name, size, entities)] = result
+
+        if progress:
+            progress(key(name, size, entities), result)
+
+    for size in sizes:
+        for name, fun in map_benchmarks(size).items():
+            record(name, size, None, fun)
+
+        for entities in entity_counts:
+            if entities > size * size // 4:
+                continue
+
+            # Filling a big map takes a while, so only do it if needed.
+            if only and not set(only) & set(ENTITY_BENCHMARKS):
+                continue
+
+            for name, fun in entity_benchmarks(size, entities).items():
+                record(name, size, entities, fun)
+
+    return results
+
+# Benchmarks that got slower than `tolerance' allows compared to the baseline,
+# as (key, baseline seconds, current seconds).
+def compare(results, baseline, tolerance):
+    regressions = []
+
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+
+        before = baseline[name]["seconds"]
+
+        if result["seconds"] > before * (1 + tolerance):
+            regressions.append((name, before, result["seconds"]))
+
+    return regressions
@@ -0,0 +1,230 @@
+import os
+import tempfile
+
+import numpy as np
+
+from .metrics import metrics
+from .mapgen import WALL_CHANCE, GENERATIONS, run_cellular_automata
+
+CHUNK_SHIFT = 5
+CHUNK_SIZE = 1 << CHUNK_SHIFT
+CHUNK_MASK = CHUNK_SIZE - 1
+
+# Chunks kept in memory at most, unless more than that are near players.
+CHUNK_BUDGET = 1024
+
+# The tile grid of a chunked world, standing in for `World.tiles': it's indexed
+# the same way, by `y * width + x', but only holds the chunks somebody looked
+# at. The rest are generated when first needed, from noise seeded by the chunk
+# coordinates alone, so a chunk comes out the same whenever and in whatever
+# order it's made. Chunks nobody was near for a while are dropped once there
+# are more than `budget' of them, after writing the ones that were changed
+# since they were generated to `directory'.
+class ChunkMap:
+    def __init__(self, width, height, radius, budget=CHUNK_BUDGET, directory=None):
+        self.width = width
+        self.height = height
+        # Chunks within this many cells of a player stay loaded.
+        self.radius = radius
+        self.budget = budget
+
+        # Swap space for this process only, nothing is read back from a
+        # previous run.
+        self.directory = tempfile.mkdtemp(prefix="chunks-", dir=directory)
+
+        self.seed = 0
+        self.wall = self.floor = 0
+        # The time of the last `stream', which is when loaded chunks were used.
+        self.time = 0
+
+        # (cx, cy) -> tile ids, row by row.
+        self.chunks = {}
+        self.last_used = {}
+        # Chunks changed since they were loaded, and since they were generated.
+        self.dirty = set()
+        self.modified = set()
+        # Chunks that had their monsters placed, see `stream'.
+        self.populated = set()
+
+    # Forgets every chunk, for a world generated anew.
+    def reset(self, seed, wall, floor):
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+
+        self.seed = seed
+        self.wall, self.floor = wall, floor
+
+        self.chunks = {}
+        self.last_used = {}
+        self.dirty = set()
+        self.modified = set()
+        self.populated = set()
+
+    def __len__(self):
+        return self.width * self.height
+
+    # Callers check the bounds first, like they do for the flat grid.
+    def __getitem__(self, i):
+        y, x = divmod(i, self.width)
+        chunk = self.chunks.get((x >> CHUNK_SHIFT, y >> CHUNK_SHIFT))
+
+        if chunk is None:
+            chunk = self.load(x >> CHUNK_SHIFT, y >> CHUNK_SHIFT)
+
+        return chunk[(y & CHUNK_MASK) << CHUNK_SHIFT | x & CHUNK_MASK]
+
+    def __setitem__(self, i, tile_id):
+        y, x = divmod(i, self.width)
+        key = (x >> CHUNK_SHIFT, y >> CHUNK_SHIFT)
+
+        chunk = self.chunks.get(key)
+
+        if chunk is None:
+            chunk = self.load(*key)
+
+        chunk[(y & CHUNK_MASK) << CHUNK_SHIFT | x & CHUNK_MASK] = tile_id
+
+        self.dirty.add(key)
+        self.modified.add(key)
+
+    def path(self, cx, cy):
+        return os.path.join(self.directory, f"{cx}_{cy}")
+
+    def get(self, cx, cy):
+        chunk = self.chunks.get((cx, cy))
+        return chunk if chunk is not None else self.load(cx, cy)
+
+    def load(self, cx, cy):
+        key = (cx, cy)
+
+        if key in self.modified:
+            with open(self.path(cx, cy), "rb") as file:
+                chunk = bytearray(file.read())
+
+            metrics.count("chunks_loaded")
+        else:
+            chunk = self.generate(cx, cy)
+
+        self.chunks[key] = chunk
+        self.last_used[key] = self.time
+
+        return chunk
+
+    def in_bounds(self, cx, cy):
+        return cx >= 0 and cy >= 0 \
+            and cx << CHUNK_SHIFT < self.width and cy << CHUNK_SHIFT < self.height
+
+    def noise(self, cx, cy):
+        rng = np.random.default_rng([self.seed, cx, cy])
+        return rng.random((CHUNK_SIZE, CHUNK_SIZE)) <= WALL_CHANCE
+
+    # A generator for anything else that is placed along with the chunk.
+    def rng(self, cx, cy):
+        return np.random.default_rng([self.seed, cx, cy, 1])
+
+    # The cellular automata only reach `GENERATIONS' cells, so running them on
+    # the noise of the chunk and its neighbours gives the same cells in the
+    # middle as running them on the whole map would: chunks fit together
+    # without seams.
+    def generate(self, cx, cy):
+        size = CHUNK_SIZE
+        walls = np.zeros((3 * size, 3 * size), dtype=bool)
+
+        for dy in range(3):
+            for dx in range(3):
+                if self.in_bounds(cx + dx - 1, cy + dy - 1):
+                    walls[dy * size:(dy + 1) * size, dx * size:(dx + 1) * size] = \
+                        self.noise(cx + dx - 1, cy + dy - 1)
+
+        xs = np.arange((cx - 1) * size, (cx + 2) * size)
+        ys = np.arange((cy - 1) * size, (cy + 2) * size)[:, None]
+
+        inside = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+        border = inside & ((xs == 0) | (xs == self.width - 1)
+                           | (ys == 0) | (ys == self.height - 1))
+
+        walls = walls & inside | border
+
+        for i in range(GENERATIONS):
+            walls = run_cellular_automata(walls)
+
+        middle = slice(size, 2 * size)
+        tiles = np.where(walls[middle, middle], self.wall, self.floor)
+
+        # Cells past the edge of the map are thin air.
+        tiles[~inside[middle, middle]] = 0
+
+        metrics.count("chunks_generated")
+
+        return bytearray(tiles.astype(np.uint8))
+
+    # Loads the chunks around the players and keeps them loaded, then drops
+    # the ones that weren't used for longest if there are too many. Returns the
+    # chunks players came near for the first time, for the world to populate.
+    def stream(self, time, players):
+        self.time = time
+        new = []
+
+        for player in players:
+            left = max(player.x - self.radius, 0) >> CHUNK_SHIFT
+            top = max(player.y - self.radius, 0) >> CHUNK_SHIFT
+            right = min(player.x + self.radius, self.width - 1) >> CHUNK_SHIFT
+            bottom = min(player.y + self.radius, self.height - 1) >> CHUNK_SHIFT
+
+            for cy in range(top, bottom + 1):
+                for cx in range(left, right + 1):
+                    key = (cx, cy)
+
+                    if key not in self.chunks:
+                        self.load(cx, cy)
+
+                    self.last_used[key] = time
+
+                    if key not in self.populated:
+                        self.populated.add(key)
+                        new.append(key)
+
+        if len(self.chunks) > self.budget:
+            self.evict(len(self.chunks) - self.budget)
+
+        return new
+
+    def evict(self, count):
+        idle = sorted((used, key) for key, used in self.last_used.items()
+                      if used < self.time)
+
+        for used, key in idle[:count]:
+            chunk = self.chunks.pop(key)
+            del self.last_used[key]
+
+            if key in self.dirty:
+                with open(self.path(*key), "wb") as file:
+                    file.write(chunk)
+
+                self.dirty.discard(key)
+
+            metrics.count("chunks_evicted")
+
+    # Chunks that differ from what they were generated as, with their tiles.
+    def changed_chunks(self):
+        for key in sorted(self.modified):
+            yield key, bytes(self.get(*key))
+
+# The glyph masks of a chunked world, standing in for `World.glyph_masks'. They
+# are worked out when asked for instead of stored, since a chunk's masks also
+# depend on its neighbours, which may not be loaded.
+class GlyphMasks:
+    def __init__(self, world):
+        self.world = world
+
+    def __getitem__(self, i):
+        world = self.world
+        y, x = divmod(i, world.width)
+
+        return world.is_impassable(x - 1, y) << 3 \
+            | world.is_impassable(x + 1, y) << 2 \
+            | world.is_impassable(x, y - 1) << 1 \
+            | world.is_impassable(x, y + 1)
+
+    def __setitem__(self, i, mask):
+        pass
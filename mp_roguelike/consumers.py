@@ -1,31 +1,114 @@
-from channels.generic.websocket import WebsocketConsumer
+from channels.generic.websocket import AsyncWebsocketConsumer
 
+import asyncio
 import random
 import json
+import time
 
-from .util import Die
-from .world import world
-from .entities import Entity
-from .ai import ControlledAI
+from .util import fields
+from .world import world, spawn_player
+from .protocol import PROTOCOLS
+from .loop import game_loop, PLAYERS_GROUP
+from .metrics import metrics
 
 players = []
 
 PLAYER_COLORS = ["red", "green", "blue", "yellow", "darkgray"]
 
+# The integer arguments of every turn type. Moves are by a step; travels are
+# to a cell in world coordinates, walked to over the following turns.
+TURN_TYPES = {
+    "move": ("dx", "dy"),
+    "travel": ("x", "y")
+}
+
+# Checks a turn sent by a client, {"turn_type": ..., "data": {...}}, and
+# returns it as (turn type, arguments), or None if it's malformed.
+def parse_turn(turn):
+    try:
+        turn_type = turn["turn_type"]
+        args = tuple(turn["data"][name] for name in TURN_TYPES[turn_type])
+    except (KeyError, TypeError):
+        return None
+
+    # Not bools either, which pass for ints.
+    if not all(type(arg) is int for arg in args):
+        return None
+
+    return turn_type, args
+
+# Frames a client can fall behind by before it's disconnected as too slow,
+# rather than buffered for without bound.
+OUTBOX_LIMIT = 1024
+
 class Player:
-    def __init__(self, consumer, name):
+    def __init__(self, consumer, name, color=None):
         self.consumer = consumer
+        self.world = consumer.world
         self.__name = name
-        self.__color = PLAYER_COLORS[len(players) % len(PLAYER_COLORS)]
+        self.__color = color or PLAYER_COLORS[len(players) % len(PLAYER_COLORS)]
 
-        world.entity_died += self.show_death_message
+        # Whether the client's view is out of date and needs a render.
+        self.dirty = True
+        self.left = False
+        # The tick of the turn the last travel was taken for, see
+        # `can_take_turn'.
+        self.travelled = None
 
-    def show_death_message(self, entity):
-        if entity not in self.entity.get_visible_entities():
+        self.world.changed += self.on_world_changed
+
+    def leave(self):
+        self.world.changed -= self.on_world_changed
+
+        self.left = True
+
+        # We might be dead and waiting to respawn. Removing the entity drops
+        # its subscriptions.
+        if self.entity.world:
+            self.entity.remove()
+
+    def mark_dirty(self, *args):
+        self.dirty = True
+
+    # Whether a turn sent now would be taken. Until the last one is done, it
+    # would be thrown away. Travels don't take the turn until it comes, so at
+    # most one is let through per turn.
+    def can_take_turn(self):
+        entity = self.entity
+
+        if not entity.world:
+            return True
+
+        return not entity.turn_done and self.travelled != entity.next_turn
+
+    # Applies a turn sent by the client, as checked by `parse_turn'.
+    def take_turn(self, turn_type, args):
+        # The player may have left before the intent got its turn.
+        if not self.entity.world:
             return
 
+        if turn_type == "move":
+            self.entity.ai.move(*args)
+        elif turn_type == "travel":
+            # Only to cells the player can see, which keeps the search short.
+            if self.entity.can_see(*args):
+                self.travelled = self.entity.next_turn
+                self.entity.ai.travel(*args)
+
+        self.mark_dirty()
+
+    def on_world_changed(self, cells):
+        x, y, r = self.entity.x, self.entity.y, self.entity.view_radius
+
+        for cx, cy in cells:
+            if abs(cx - x) <= r and abs(cy - y) <= r:
+                self.dirty = True
+                return
+
+    # Only called for deaths we can see.
+    def show_death_message(self, entity):
         msg = f"{entity.fancy_name} was killed by {entity.attacked_by.fancy_name}"
-        self.consumer.send_message_to_all("Game", msg)
+        self.consumer.send_message("Game", msg)
 
     def show_dealt_damage(self, enemy, dmg):
         msg = f"{self.entity.fancy_you} hit {enemy.fancy_name} for {dmg} damage!"
@@ -42,92 +125,200 @@ class Player:
         self.consumer.send_message("Game", f"{entity.fancy_name} has dodged!")
 
     def respawn(self):
-        self.entity = Entity({
-            "name": self.__name,
-            "character": "@",
-            "color": self.__color,
-            "ai_type": ControlledAI,
-            "hp_roll": Die(3, 8, +40),
-            "attack_roll": Die(2, 6, +2),
-            "view_radius": 10
-        })
+        if self.left:
+            return
 
-        world.add_entity(self.entity)
+        entity = spawn_player(self.__name, self.__color)
 
-        self.entity.dead += self.respawn
+        self.world.add_entity(entity)
+        self.attach(entity)
+
+    # Deaths happen during an update, but joining the world waits for the
+    # next one, like every other input in the turn log.
+    def respawn_later(self):
+        self.world.later(self.respawn)
+
+    # Takes control of an entity that is already in the world.
+    def attach(self, entity):
+        self.entity = entity
+        self.travelled = None
+
+        self.dirty = True
+
+        self.world.entity_died.subscribe(entity, self.show_death_message)
+
+        self.entity.dead += self.respawn_later
+        self.entity.moved += self.mark_dirty
+        self.entity.damaged += self.mark_dirty
         self.entity.damaged += self.show_taken_damage
         self.entity.attacked += self.show_dealt_damage
         self.entity.dodged += self.show_dodged_message
         self.entity.target_dodged += self.show_target_dodged_message
 
-def update_all():
-    for player in players:
-        player.consumer.update()
+# Everything needed to render for and talk to one client, whether it is
+# connected to this process or to a frontend in front of a world shard.
+class Session:
+    world = world
+    view = None
+
+    def send_frame(self, text_data=None, bytes_data=None):
+        raise NotImplementedError
 
-class RoguelikeConsumer(WebsocketConsumer):
-    def connect(self):
+    def send_message_to_all(self, sender, text):
+        raise NotImplementedError
+
+    @staticmethod
+    def encode(event, data):
+        started = time.perf_counter()
+
+        text = json.dumps({
+            "e": event,
+            "d": data
+        }, default=fields)
+
+        metrics.observe("json_encode", time.perf_counter() - started)
+
+        return text
+
+    def respond(self, event, data):
+        self.send_frame(text_data=self.encode(event, data))
+
+    def send_message(self, sender, text):
+        self.respond("message", {
+            "sender": sender,
+            "text": text
+        })
+
+    def update(self, player=None):
+        if not player:
+            player = self.player
+
+        # Dead, and respawning next tick; render then.
+        if not player.entity.world:
+            player.dirty = True
+            return
+
+        started = time.perf_counter()
+
+        if player.consumer.view:
+            for frame in player.consumer.view.encode(player.entity):
+                if isinstance(frame, bytes):
+                    player.consumer.send_frame(bytes_data=frame)
+                else:
+                    player.consumer.respond(*frame)
+        else:
+            tiles, entities = player.entity.get_renderable()
+
+            player.consumer.respond("update", {
+                "tiles": tiles,
+                "entities": entities,
+                "player": player.entity.stripped()
+            })
+
+        metrics.observe("render", time.perf_counter() - started)
+
+class RoguelikeConsumer(Session, AsyncWebsocketConsumer):
+    game_loop = game_loop
+
+    async def connect(self):
         self.handlers = {
             "auth": self.on_auth,
             "turn": self.on_turn,
-            "chat": self.on_chat
+            "chat": self.on_chat,
+            "keyframe": self.on_keyframe
         }
 
-        self.accept();
+        self.view = None
+
+        # Frames are written to the socket by a separate task, so rendering
+        # for this client never waits on its connection.
+        self.outbox = asyncio.Queue(OUTBOX_LIMIT)
+        self.too_slow = False
+        self.writer = asyncio.ensure_future(self.write_outbox())
+
+        await self.channel_layer.group_add(PLAYERS_GROUP, self.channel_name)
+        await self.accept()
+
+        if self.game_loop:
+            self.game_loop.start()
+
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(PLAYERS_GROUP, self.channel_name)
 
-    def disconnect(self, close_code):
         if hasattr(self, "player") and self.player:
             goodbye_msg = f"{self.player.entity.fancy_name} disconnected"
             self.send_message_to_all("Server", goodbye_msg)
 
-            self.player.entity.remove()
+            self.player.leave()
             players.remove(self.player)
 
-            update_all()
+            game_loop.request_broadcast()
 
-    def receive(self, text_data):
+        self.writer.cancel()
+
+    async def receive(self, text_data=None, bytes_data=None):
         decoded = json.loads(text_data)
 
         event = decoded["e"]
 
         if event in self.handlers:
-            self.handlers[event](decoded["d"])
+            await self.handlers[event](decoded["d"])
 
-    def respond(self, event, data):
-        self.send(json.dumps({
-            "e": event,
-            "d": data
-        }, default=lambda x: x.__dict__))
+    async def write_outbox(self):
+        while True:
+            text_data, bytes_data = await self.outbox.get()
+            await self.send(text_data=text_data, bytes_data=bytes_data)
 
-    def send_message(self, sender, text):
-        self.respond("message", {
+    def send_frame(self, text_data=None, bytes_data=None):
+        self.enqueue((text_data, bytes_data),
+                     len(bytes_data) if bytes_data is not None
+                     else len(text_data.encode()))
+
+    # Queues a frame of `size' bytes, which may be shared with other clients.
+    def enqueue(self, frame, size):
+        metrics.count("frames_sent")
+        metrics.count("bytes_sent", size)
+
+        try:
+            self.outbox.put_nowait(frame)
+        except asyncio.QueueFull:
+            if not self.too_slow:
+                self.too_slow = True
+                metrics.count("slow_clients_dropped")
+
+                asyncio.ensure_future(self.close())
+
+    # The message is encoded once, and the same frame queued for everyone.
+    def send_message_to_all(self, sender, text):
+        text_data = self.encode("message", {
             "sender": sender,
             "text": text
         })
 
-    def send_message_to_all(self, sender, text):
-        self.all(lambda player: player.consumer.send_message(sender, text))
+        frame = (text_data, None)
+        size = len(text_data.encode())
+
+        for player in players:
+            player.consumer.enqueue(frame, size)
 
     def all(self, fun, *args, **kwargs):
         for player in players:
             fun(player, *args, **kwargs)
 
-    def update(self, player=None):
-        if not player:
-            player = self.player
-
-        tiles, entities = player.entity.get_renderable()
+    async def world_tick(self, event):
+        if hasattr(self, "player") and self.player and self.player.dirty:
+            self.player.dirty = False
+            self.update()
 
-        player.consumer.respond("update", {
-            "tiles": tiles,
-            "entities": entities,
-            "player": player.entity.stripped()
-        })
-
-    def on_auth(self, data):
+    async def on_auth(self, data):
         if not data or "name" not in data:
-            return self.close()
+            return await self.close()
 
         name = data["name"] or f"Guest{random.randint(1, 10000):04}"
+
+        if data.get("protocol") in PROTOCOLS:
+            self.view = PROTOCOLS[data["protocol"]]()
+
         self.player = Player(self, name)
         players.append(self.player)
         self.player.respawn()
@@ -138,25 +329,20 @@ class RoguelikeConsumer(WebsocketConsumer):
         self.send_message_to_all("Server", welcome_msg)
         self.send_message("Online", players_list)
 
-        update_all()
-
-    def on_move_turn(self, data):
-        self.player.entity.ai.move(data["dx"], data["dy"])
-
-    def on_turn(self, data):
-        turn_handlers = {
-            "move": self.on_move_turn
-        }
-
-        turn_type = data["turn_type"]
+        game_loop.request_broadcast()
 
-        if turn_type in turn_handlers:
-            turn_handlers[turn_type](data["data"])
+    async def on_turn(self, data):
+        turn = parse_turn(data)
 
-        world.update()
+        if turn and getattr(self, "player", None):
+            game_loop.submit(self, self.player.take_turn, *turn,
+                             ready=self.player.can_take_turn)
 
-        update_all()
+    async def on_keyframe(self, data):
+        if self.view:
+            self.view.reset()
+            self.update()
 
-    def on_chat(self, data):
+    async def on_chat(self, data):
         if data["message"]:
             self.send_message_to_all(self.player.entity.fancy_name, data["message"])
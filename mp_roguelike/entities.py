@@ -1,23 +1,53 @@
-import random
+import itertools
 
-from .event import Sender
+from .event import Signal
+from .metrics import metrics
 from .util import get_param, Die
 
 from .tiles import Tile
+from .fov import compute_fov
+from .scheduler import NORMAL_SPEED
 from . import ai
 
+# An action waiting for its entity's turn.
 class Turn:
-    def __init__(self, entity, action, *args, **kwargs):
+    __slots__ = ("entity", "action", "args")
+
+    def __init__(self, entity, action, *args):
         self.entity = entity
         self.action = action
         self.args = args
-        self.kwargs = kwargs
 
     def do(self):
         if self.entity.world:
-            self.action(*self.args, **self.kwargs)
+            self.action(*self.args)
+
+# Dice are never modified, so entities can share the default ones.
+DEFAULT_HP_ROLL = Die(1, 4, +10)
+DEFAULT_ATTACK_ROLL = Die(1, 6)
+
+# The attacker of entities nobody attacked yet. Attackers are only ever
+# replaced, not changed, so every entity can start out with the same one.
+NOBODY = Tile()
 
 class Entity(Tile):
+    __slots__ = ("id", "world", "x", "y", "view_radius", "hp", "attacked_by",
+                 "hp_roll", "attack_roll", "ai", "speed", "next_turn", "turn_ticket",
+                 "turn_done", "fov", "fov_key", "row",
+                 "_added", "_damaged", "_dead", "_attacked", "_moved",
+                 "_dodged", "_target_dodged")
+
+    ids = itertools.count()
+
+    # Most entities never get subscribers, so these cost nothing until then.
+    added = Signal()
+    damaged = Signal()
+    dead = Signal()
+    attacked = Signal()
+    moved = Signal()
+    dodged = Signal()
+    target_dodged = Signal()
+
     def __init__(self, params):
         name = get_param(params, "name", "meh")
         character = get_param(params, "character", "g")
@@ -25,29 +55,36 @@ class Entity(Tile):
 
         super().__init__(name, character, color)
 
+        self.id = next(Entity.ids)
+        self.world = None
+
         self.x = -1
         self.y = -1
 
         self.view_radius = get_param(params, "view_radius", 8)
 
-        self.hp = get_param(params, "hp_roll", Die(1, 4, +10)).roll()
+        # Rolled from the world's RNG once the entity is added, unless it is
+        # set before that.
+        self.hp = None
+        self.hp_roll = get_param(params, "hp_roll", DEFAULT_HP_ROLL)
 
-        self.attacked_by = Tile()
+        self.attacked_by = NOBODY
 
-        self.attack_roll = get_param(params, "attack_roll", Die(1, 6))
+        self.attack_roll = get_param(params, "attack_roll", DEFAULT_ATTACK_ROLL)
 
         ai_args = get_param(params, "ai_args", ())
         self.ai = get_param(params, "ai_type", ai.AggressiveAI)(self, *ai_args)
 
+        self.speed = get_param(params, "speed", NORMAL_SPEED)
+        # The tick of the entity's next turn, kept by the world's scheduler.
+        self.next_turn = 0
+        self.turn_ticket = None
         self.turn_done = False
 
-        self.added = Sender()
-        self.damaged = Sender()
-        self.dead = Sender()
-        self.attacked = Sender()
-        self.moved = Sender()
-        self.dodged = Sender()
-        self.target_dodged = Sender()
+        self.fov = frozenset()
+        self.fov_key = None
+        # Our row in the world's `EntityStore', if it keeps one.
+        self.row = None
 
     def remove(self):
         self.world.remove_entity(self)
@@ -60,7 +97,11 @@ class Entity(Tile):
 
     def stripped(self):
         return {
-            **Tile(self.name, self.character, self.color).__dict__,
+            "name": self.name,
+            "character": self.character,
+            "background": self.background,
+            "color": self.color,
+            "id": self.id,
             "x": self.x,
             "y": self.y,
             "hp": self.hp,
@@ -81,68 +122,71 @@ class Entity(Tile):
         else:
             return [], []
 
+    def get_visible_tiles(self):
+        if self.world:
+            return self.world.get_visible_tiles(self)
+        else:
+            return []
+
+    def set_position(self, x, y):
+        if self.world:
+            self.world.move_entity(self, x, y)
+        else:
+            self.x, self.y = x, y
+
     def set_random_position(self):
         while self.world.is_occupied(self.x, self.y):
-            self.x = random.randint(0, self.world.width)
-            self.y = random.randint(0, self.world.height)
+            self.set_position(*self.world.random_position())
 
     def damage(self, dmg):
         self.hp -= dmg
 
+        self.world.mark_changed(self.x, self.y)
+
+        if self.world.store:
+            self.world.store.set_hp(self)
+
         self.damaged(dmg)
 
         if self.hp <= 0 and self.hp + dmg > 0:
             self.die()
 
     def die(self):
-        self.world.entity_died(self)
+        self.world.entity_died(self.x, self.y, self)
         self.dead()
         self.remove()
 
     def is_at(self, x, y):
         return self.x == x and self.y == y
 
-    def can_see(self, x, y):
-        dx, dy = x - self.x, y - self.y
-
-        if dx*dx + dy*dy > self.view_radius**2:
-            return False
-
-        cx, cy = self.x, self.y
-
-        if abs(dx) >= abs(dy):
-            step = abs(dx);
-        else:
-            step = abs(dy);
-
-        if step == 0:
-            return True
+    # The visible cells are computed once per position, view radius and map
+    # version, and shared by every visibility query until one of them changes.
+    def get_fov(self):
+        if not self.world:
+            return frozenset()
 
-        dx = dx / step;
-        dy = dy / step;
+        key = (self.x, self.y, self.view_radius, self.world.version)
 
-        i = 0
+        if key != self.fov_key:
+            self.fov = compute_fov(self.world, self.x, self.y, self.view_radius)
+            self.fov_key = key
 
-        blocked = False
+            metrics.count("fov_computed")
 
-        while i < step:
-            cx += dx
-            cy += dy
-            i += 1
+        return self.fov
 
-            if self.world.get_tile_at(int(cx), int(cy)).opaque:
-                if blocked:
-                    return False
-
-                blocked = True
-
-        return True
+    def can_see(self, x, y):
+        return (x, y) in self.get_fov()
 
     def is_in_movement_range(self, dx, dy):
         return abs(dx) <= 1 and abs(dy) <= 1
 
     def on_add(self, world):
         self.world = world
+
+        if self.hp is None:
+            self.hp = self.hp_roll(rng=world.random)
+
         self.set_random_position()
         self.added()
 
@@ -151,7 +195,7 @@ class Entity(Tile):
 
     def attack(self, entity):
         entity.attacked_by = self
-        dmg = self.attack_roll()
+        dmg = self.attack_roll(rng=self.world.random)
         self.attacked(entity, dmg)
         entity.damage(dmg)
 
@@ -170,14 +214,17 @@ class Entity(Tile):
             return self.attack(target)
 
         if not target and not self.world.is_occupied(*new_pos):
-            self.x, self.y = new_pos
+            self.set_position(*new_pos)
             return self.moved(dx, dy)
 
         if target:
             self.target_dodged(target)
             target.dodged()
         elif current_targets:
-            self.attack(self.choose_target(current_targets))
+            target = self.choose_target(current_targets)
+
+            if target:
+                self.attack(target)
 
     def queue_move(self, dx, dy):
         x, y = self.x + dx, self.y + dy
@@ -188,6 +235,8 @@ class Entity(Tile):
             self.world.queue_turn(turn)
 
 class Spawner(Entity):
+    __slots__ = ()
+
     def __init__(self, params):
         params["hp_roll"] = Die(5, 20, +300)
         params["attack_roll"] = Die(0, 0)
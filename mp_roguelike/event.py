@@ -1,4 +1,8 @@
+import weakref
+
 class Sender:
+    __slots__ = ("subscribers",)
+
     def __init__(self):
         self.subscribers = []
 
@@ -13,3 +17,77 @@ class Sender:
     def __isub__(self, handler):
         self.subscribers.remove(handler)
         return self
+
+# Like `Sender', for events that happen at a spot on the map, and only heard
+# by the observers whose field of view holds that spot. Observers are entities,
+# found through the world's spatial index, so an event costs as much as there
+# are entities around it, however many are subscribed elsewhere. Handlers are
+# bound methods held by weak reference: one whose object is gone is dropped the
+# next time it would have been called.
+class LocalSender:
+    __slots__ = ("index", "radius", "handlers")
+
+    def __init__(self, index):
+        self.index = index
+        # The largest view radius among the observers.
+        self.radius = 0
+        # Observer -> weak reference to its handler.
+        self.handlers = {}
+
+    def __call__(self, x, y, *args, **kwargs):
+        if not self.handlers:
+            return
+
+        for observer in self.index.in_radius(x, y, self.radius):
+            ref = self.handlers.get(observer)
+
+            if ref is None:
+                continue
+
+            handler = ref()
+
+            if handler is None:
+                del self.handlers[observer]
+            elif observer.can_see(x, y):
+                handler(*args, **kwargs)
+
+    def subscribe(self, observer, handler):
+        self.handlers[observer] = weakref.WeakMethod(handler)
+        self.radius = max(self.radius, observer.view_radius)
+
+    def unsubscribe(self, observer):
+        self.handlers.pop(observer, None)
+
+# Stands in for a signal nobody has subscribed to yet. Subscribing replaces it
+# with a real `Sender'.
+class Silent:
+    __slots__ = ()
+
+    def __call__(self, *args, **kwargs):
+        pass
+
+    def __iadd__(self, handler):
+        sender = Sender()
+        sender += handler
+        return sender
+
+    def __isub__(self, handler):
+        raise ValueError("handler is not subscribed")
+
+silent = Silent()
+
+# A `Sender' attribute that is only allocated once someone subscribes to it.
+# The owning class needs a slot named after the attribute with a leading
+# underscore to hold it.
+class Signal:
+    def __set_name__(self, owner, name):
+        self.slot = "_" + name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+
+        return getattr(obj, self.slot, silent)
+
+    def __set__(self, obj, sender):
+        setattr(obj, self.slot, sender)
@@ -0,0 +1,65 @@
+# Recursive shadowcasting, one pass per octant. Each octant is described by the
+# transform from its local (column, row) coordinates into map deltas.
+OCTANTS = [
+    (1, 0, 0, 1),
+    (0, 1, 1, 0),
+    (0, -1, 1, 0),
+    (-1, 0, 0, 1),
+    (-1, 0, 0, -1),
+    (0, -1, -1, 0),
+    (0, 1, -1, 0),
+    (1, 0, 0, -1)
+]
+
+def compute_fov(world, x, y, radius):
+    visible = {(x, y)}
+
+    for xx, xy, yx, yy in OCTANTS:
+        cast_light(world, visible, x, y, radius, 1, 1.0, 0.0, xx, xy, yx, yy)
+
+    return visible
+
+def cast_light(world, visible, cx, cy, radius, row, start, end, xx, xy, yx, yy):
+    if start < end:
+        return
+
+    r2 = radius * radius
+    new_start = start
+
+    for j in range(row, radius + 1):
+        dx, dy = -j - 1, -j
+        blocked = False
+
+        while dx <= 0:
+            dx += 1
+
+            l_slope = (dx - 0.5) / (dy + 0.5)
+            r_slope = (dx + 0.5) / (dy - 0.5)
+
+            if start < r_slope:
+                continue
+            elif end > l_slope:
+                break
+
+            x = cx + dx * xx + dy * xy
+            y = cy + dx * yx + dy * yy
+
+            if dx*dx + dy*dy <= r2:
+                visible.add((x, y))
+
+            opaque = world.is_opaque(x, y)
+
+            if blocked:
+                if opaque:
+                    new_start = r_slope
+                else:
+                    blocked = False
+                    start = new_start
+            elif opaque and j < radius:
+                blocked = True
+                cast_light(world, visible, cx, cy, radius, j + 1, start, l_slope,
+                           xx, xy, yx, yy)
+                new_start = r_slope
+
+        if blocked:
+            break
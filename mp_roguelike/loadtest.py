@@ -0,0 +1,187 @@
+import asyncio
+import json
+import random
+import time
+
+from channels.testing import WebsocketCommunicator
+
+from .loop import game_loop
+from .protocol import FRAME_HEADER, FRAME_VIEWPORT
+
+# Events that carry the player's view, as opposed to chat and palettes.
+VIEW_EVENTS = {"update", "keyframe", "patch"}
+
+# Seconds a client waits for its turn to show before giving up on it. Moves
+# into a wall or another player are never taken, so nothing answers them.
+TURN_TIMEOUT = 2
+
+# Every direction but standing still, which the server ignores.
+DIRECTIONS = [(dx, dy) for dy in (-1, 0, 1) for dx in (-1, 0, 1) if dx or dy]
+
+# The player's own stats in a view frame, or None if the frame leaves them out.
+def player_state(frame):
+    if frame.get("bytes") is not None:
+        data = frame["bytes"]
+        kind, _, _, _, runs_size = FRAME_HEADER.unpack_from(data)
+
+        if kind != FRAME_VIEWPORT:
+            return None
+
+        return json.loads(data[FRAME_HEADER.size + runs_size:])["player"]
+
+    return json.loads(frame["text"])["d"].get("player")
+
+# One simulated player: connects through the ASGI app, then sends a turn every
+# `1 / turn_rate' seconds and now and then a chat message. Each turn is timed
+# until the player's own state changes, that is when the server takes the turn
+# or the player moves, or it is given up on after TURN_TIMEOUT seconds.
+class SimulatedClient:
+    def __init__(self, application, name, protocol="", turn_rate=2, chat_rate=0.1):
+        self.communicator = WebsocketCommunicator(application, "/server/")
+        self.name = name
+        self.protocol = protocol
+        self.turn_rate = turn_rate
+        self.chat_rate = chat_rate
+
+        self.random = random.Random(name)
+
+        self.latencies = []
+        self.unanswered = 0
+        self.messages = 0
+        self.bytes = 0
+
+        # When the turn we're waiting to see answered was sent, and what the
+        # player looked like then.
+        self.turn_sent = None
+        self.sent_state = None
+        # Position and whether a turn is pending, as last seen.
+        self.state = None
+
+    async def send(self, event, data):
+        await self.communicator.send_json_to({"e": event, "d": data})
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect()
+
+        if not connected:
+            raise RuntimeError(f"{self.name} could not connect")
+
+        await self.send("auth", {"name": self.name, "protocol": self.protocol})
+
+    async def receive(self):
+        while True:
+            frame = await self.communicator.receive_output(timeout=None)
+
+            if frame["type"] != "websocket.send":
+                return
+
+            if frame.get("bytes") is not None:
+                self.bytes += len(frame["bytes"])
+                is_view = True
+            else:
+                self.bytes += len(frame["text"].encode())
+                is_view = json.loads(frame["text"])["e"] in VIEW_EVENTS
+
+            self.messages += 1
+
+            player = player_state(frame) if is_view else None
+
+            if not player:
+                continue
+
+            self.state = (player["x"], player["y"], player["turn_done"])
+
+            if self.turn_sent is not None and self.state != self.sent_state:
+                self.latencies.append(time.perf_counter() - self.turn_sent)
+                self.turn_sent = None
+
+    async def play(self, duration):
+        # Don't all act on the same tick.
+        await asyncio.sleep(self.random.random() / self.turn_rate)
+
+        stop = time.perf_counter() + duration
+
+        while time.perf_counter() < stop:
+            if self.turn_sent is not None \
+               and time.perf_counter() - self.turn_sent > TURN_TIMEOUT:
+                self.unanswered += 1
+                self.turn_sent = None
+
+            # Nothing to tell an answer by until the first frame shows up.
+            if self.turn_sent is None and self.state is not None:
+                self.turn_sent = time.perf_counter()
+                self.sent_state = self.state
+
+                dx, dy = self.random.choice(DIRECTIONS)
+
+                await self.send("turn", {
+                    "turn_type": "move",
+                    "data": {"dx": dx, "dy": dy}
+                })
+
+            if self.random.random() < self.chat_rate:
+                await self.send("chat", {"message": "load test"})
+
+            await asyncio.sleep(1 / self.turn_rate)
+
+    async def disconnect(self):
+        await self.communicator.disconnect()
+
+def percentile(values, fraction):
+    if not values:
+        return float("nan")
+
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+# Runs `clients' simulated players against the app for `duration' seconds, and
+# returns what it measured.
+async def run(application, clients, duration, protocol="", turn_rate=2,
+              chat_rate=0.1):
+    players = [SimulatedClient(application, f"load{i}", protocol, turn_rate,
+                               chat_rate)
+               for i in range(clients)]
+
+    for player in players:
+        await player.connect()
+
+    receivers = [asyncio.ensure_future(player.receive()) for player in players]
+
+    # Only count what happens once everyone is in.
+    ticks, tick_cpu = game_loop.ticks, game_loop.tick_cpu
+    cpu = time.process_time()
+    started = time.perf_counter()
+    messages = sum(player.messages for player in players)
+    sent_bytes = sum(player.bytes for player in players)
+
+    await asyncio.gather(*(player.play(duration) for player in players))
+
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu
+    ticks = max(game_loop.ticks - ticks, 1)
+    tick_cpu = game_loop.tick_cpu - tick_cpu
+    messages = sum(player.messages for player in players) - messages
+    sent_bytes = sum(player.bytes for player in players) - sent_bytes
+
+    for receiver in receivers:
+        receiver.cancel()
+
+    for player in players:
+        await player.disconnect()
+
+    latencies = [latency for player in players for latency in player.latencies]
+
+    return {
+        "clients": clients,
+        "protocol": protocol or "json",
+        "turns": len(latencies),
+        "unanswered": sum(player.unanswered for player in players),
+        "latency_p50_ms": percentile(latencies, 0.5) * 1000,
+        "latency_p90_ms": percentile(latencies, 0.9) * 1000,
+        "latency_p99_ms": percentile(latencies, 0.99) * 1000,
+        "messages_per_s": messages / elapsed,
+        "bytes_per_s": sent_bytes / elapsed,
+        "ticks": ticks,
+        "tick_cpu_ms": tick_cpu / ticks * 1000,
+        "process_cpu_per_tick_ms": cpu / ticks * 1000
+    }
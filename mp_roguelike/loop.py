@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import os
+import time
+
+from collections import deque
+
+from channels.layers import get_channel_layer
+
+from .world import world
+from . import snapshot, turnlog
+from .metrics import metrics, SlowTickSampler
+
+logger = logging.getLogger(__name__)
+
+PLAYERS_GROUP = "players"
+
+# Seconds between world ticks.
+TICK_INTERVAL = 0.1
+
+# Intents a connection can have waiting; any more sent meanwhile are dropped.
+# They are applied in order, at most one per tick, and only once the previous
+# one is done with, see `submit'.
+INTENT_LIMIT = 4
+
+# The single authoritative owner of the world's time. Consumers only submit
+# intents; the loop applies them, steps the world every tick whether or not
+# anyone acted, and tells every consumer in `PLAYERS_GROUP' to render, without
+# waiting for any of their sockets. At most one render pass happens per tick,
+# and only players marked dirty render.
+class GameLoop:
+    def __init__(self, world, interval=TICK_INTERVAL):
+        self.world = world
+        self.interval = interval
+
+        # Connection -> its intents, oldest first.
+        self.intents = {}
+        self.broadcast_requested = False
+
+        self.snapshot_path = None
+        self.snapshot_interval = None
+        self.next_snapshot = 0
+        self.saving = None
+
+        # CPU seconds spent in ticks, and how many there were, for load tests.
+        self.ticks = 0
+        self.tick_cpu = 0
+
+        self.sampler = None
+
+        self.task = None
+
+    # Restores the world from `path' if it was saved before, and saves it
+    # there every `interval' seconds from then on. With a turn log, whatever
+    # happened after the last snapshot is replayed on top.
+    def enable_snapshots(self, path, interval, log_path=None):
+        self.snapshot_path = path
+        self.snapshot_interval = interval
+
+        if not os.path.exists(path):
+            if log_path:
+                self.enable_turn_log(log_path)
+            return
+
+        snapshot.load(self.world, path)
+
+        if log_path and os.path.exists(log_path):
+            turnlog.replay(self.world, turnlog.read(log_path))
+
+        if log_path:
+            self.enable_turn_log(log_path)
+
+        # Players belong to connections, which didn't survive the restart.
+        for player in list(self.world.players):
+            self.world.remove_entity(player)
+
+    # Logs where the time goes in ticks longer than `threshold' seconds.
+    def enable_slow_tick_sampler(self, threshold):
+        self.sampler = SlowTickSampler(threshold)
+
+    def enable_turn_log(self, path):
+        self.world.turn_log = turnlog.TurnLog(path)
+        self.world.turn_log.start(self.world)
+
+    # The world is copied on the loop, but encoded and written out by a worker
+    # thread, so the tick never waits on the disk.
+    def save_snapshot(self):
+        if self.saving and not self.saving.done():
+            return
+
+        clock = asyncio.get_running_loop()
+
+        self.next_snapshot = clock.time() + self.snapshot_interval
+        self.saving = clock.run_in_executor(None, snapshot.write,
+                                            self.snapshot_path,
+                                            snapshot.capture(self.world))
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+
+    # Queues an intent of `source', a connection. If given, `ready' is asked
+    # every tick whether the intent can be applied yet, and holds back the
+    # rest of the queue until it can: a player can't take a new turn while the
+    # last one is still waiting for its tick to come.
+    def submit(self, source, intent, *args, ready=None, **kwargs):
+        queue = self.intents.get(source)
+
+        if queue is None:
+            queue = self.intents[source] = deque()
+
+        if len(queue) >= INTENT_LIMIT:
+            metrics.count("intents_dropped")
+            return
+
+        queue.append((intent, args, kwargs, ready))
+
+    def request_broadcast(self):
+        self.broadcast_requested = True
+
+    # Returns whether anything happened that players should see.
+    def tick(self):
+        started = time.perf_counter()
+
+        intents = 0
+
+        for source, queue in list(self.intents.items()):
+            intent, args, kwargs, ready = queue[0]
+
+            # One client's bad input mustn't stop the world for everyone.
+            try:
+                if ready and not ready():
+                    continue
+
+                queue.popleft()
+                intents += 1
+
+                intent(*args, **kwargs)
+            except Exception:
+                logger.exception("Intent %r failed", intent)
+                metrics.count("intents_failed")
+
+            if not queue:
+                del self.intents[source]
+
+        applied = time.perf_counter()
+        metrics.observe("intents", applied - started)
+        metrics.count("intents", intents)
+
+        self.world.update()
+
+        updated = time.perf_counter()
+        metrics.observe("update", updated - applied)
+
+        changed = self.world.flush_changes()
+
+        metrics.observe("flush_changes", time.perf_counter() - updated)
+
+        if self.world.turn_log:
+            self.world.turn_log.flush()
+
+        broadcast = bool(intents) or changed or self.broadcast_requested
+        self.broadcast_requested = False
+
+        return broadcast
+
+    async def run(self):
+        channel_layer = get_channel_layer()
+        clock = asyncio.get_running_loop()
+
+        if self.sampler:
+            self.sampler.start()
+
+        while True:
+            started = clock.time()
+            cpu = time.process_time()
+
+            if self.sampler:
+                self.sampler.tick_started()
+
+            if self.tick():
+                await channel_layer.group_send(PLAYERS_GROUP, {
+                    "type": "world.tick"
+                })
+
+            if self.sampler:
+                self.sampler.tick_finished()
+
+            metrics.record_tick(clock.time() - started)
+
+            self.ticks += 1
+            self.tick_cpu += time.process_time() - cpu
+
+            if self.snapshot_path and started >= self.next_snapshot:
+                self.save_snapshot()
+
+            elapsed = clock.time() - started
+            await asyncio.sleep(max(0, self.interval - elapsed))
+
+game_loop = GameLoop(world)
@@ -0,0 +1,53 @@
+import json
+import platform
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mp_roguelike import bench
+
+class Command(BaseCommand):
+    help = "Times the world's hot paths, optionally failing on regressions against a baseline."
+
+    def add_arguments(self, parser):
+        parser.add_argument("only", nargs="*",
+                            help="benchmarks to run, all of them by default")
+        parser.add_argument("--sizes", type=int, nargs="+", default=[100, 500],
+                            help="map widths and heights to try")
+        parser.add_argument("--entities", type=int, nargs="+", default=[100, 1000],
+                            help="entity counts to try")
+        parser.add_argument("--min-time", type=float, default=bench.MIN_TIME,
+                            help="seconds to keep repeating each benchmark for")
+        parser.add_argument("--output", help="write the results here as JSON")
+        parser.add_argument("--baseline", help="compare against results saved with --output")
+        parser.add_argument("--tolerance", type=float, default=0.2,
+                            help="how much slower than the baseline is still fine")
+
+    def handle(self, *args, only, sizes, entities, min_time, output=None,
+               baseline=None, tolerance=0.2, **options):
+        def progress(key, result):
+            self.stdout.write(f"{key:<40} {result['seconds'] * 1e6:>12.1f} us"
+                              f"  ({result['runs']} runs)")
+
+        results = bench.run(sizes, entities, only, min_time, progress)
+
+        if output:
+            with open(output, "w") as file:
+                json.dump({
+                    "python": platform.python_version(),
+                    "results": results
+                }, file, indent=2)
+
+        if not baseline:
+            return
+
+        with open(baseline) as file:
+            regressions = bench.compare(results, json.load(file)["results"],
+                                        tolerance)
+
+        for key, before, after in regressions:
+            self.stderr.write(f"{key}: {before * 1e6:.1f} us -> {after * 1e6:.1f} us "
+                              f"({after / before - 1:+.0%})")
+
+        if regressions:
+            raise CommandError(f"{len(regressions)} benchmarks regressed by more "
+                               f"than {tolerance:.0%}")
@@ -0,0 +1,61 @@
+import asyncio
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from mp_roguelike import loadtest
+
+COLUMNS = [
+    ("clients", "clients", "{:.0f}"),
+    ("turns", "turns", "{:.0f}"),
+    ("unanswered", "unanswered", "{:.0f}"),
+    ("latency_p50_ms", "p50 ms", "{:.1f}"),
+    ("latency_p90_ms", "p90 ms", "{:.1f}"),
+    ("latency_p99_ms", "p99 ms", "{:.1f}"),
+    ("messages_per_s", "msg/s", "{:.0f}"),
+    ("bytes_per_s", "bytes/s", "{:.0f}"),
+    ("tick_cpu_ms", "tick cpu ms", "{:.2f}"),
+    ("process_cpu_per_tick_ms", "cpu/tick ms", "{:.2f}")
+]
+
+class Command(BaseCommand):
+    help = "Plays simulated clients against the server in-process and reports how it copes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("clients", type=int, nargs="*", default=[1, 10, 50],
+                            help="numbers of clients to try, one run each")
+        parser.add_argument("--duration", type=float, default=10,
+                            help="seconds each run lasts")
+        parser.add_argument("--protocol", default="",
+                            help="view protocol the clients ask for")
+        parser.add_argument("--turn-rate", type=float, default=2,
+                            help="turns each client sends per second")
+        parser.add_argument("--chat-rate", type=float, default=0.1,
+                            help="chance of a chat message with each turn")
+        parser.add_argument("--json", dest="as_json", action="store_true",
+                            help="print the results as JSON")
+
+    def handle(self, *args, clients, duration, protocol, turn_rate, chat_rate,
+               as_json, **options):
+        if settings.ROGUELIKE_SHARDS:
+            raise CommandError("load tests run against the unsharded server only")
+
+        from mp_roguelike.routing import application
+
+        async def run_all():
+            return [await loadtest.run(application, count, duration, protocol,
+                                       turn_rate, chat_rate)
+                    for count in clients]
+
+        results = asyncio.run(run_all())
+
+        if as_json:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write("  ".join(f"{title:>11}" for _, title, _ in COLUMNS))
+
+        for result in results:
+            self.stdout.write("  ".join(f"{format.format(result[key]):>11}"
+                                        for key, _, format in COLUMNS))
@@ -0,0 +1,53 @@
+import hashlib
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mp_roguelike import snapshot, turnlog
+from mp_roguelike.world import World
+
+# Identifies the state of a world, for checking that two runs agree.
+def digest(world):
+    if world.chunks:
+        # Chunks that were never changed are the same everywhere.
+        state = hashlib.sha256()
+
+        for key, tiles in world.chunks.changed_chunks():
+            state.update(f"{key}".encode())
+            state.update(tiles)
+    else:
+        state = hashlib.sha256(bytes(world.tiles))
+
+    for entity in world.entities:
+        state.update(f"{entity.name} {entity.x} {entity.y} {entity.hp};".encode())
+
+    return state.hexdigest()
+
+class Command(BaseCommand):
+    help = "Replays a turn log headlessly, as fast as possible."
+
+    def add_arguments(self, parser):
+        parser.add_argument("log")
+        parser.add_argument("--snapshot", dest="snapshot_path",
+                            help="start from this snapshot instead of the first world in the log")
+
+    def handle(self, *args, log, snapshot_path=None, **options):
+        records = turnlog.read(log)
+
+        if not records:
+            raise CommandError(f"{log} has no records")
+
+        if snapshot_path:
+            world = World(1, 1)
+            snapshot.load(world, snapshot_path)
+        else:
+            world = turnlog.new_world(records)
+
+        started = time.perf_counter()
+        updates = turnlog.replay(world, records)
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(f"{updates} updates in {elapsed:.3f}s "
+                          f"({updates / max(elapsed, 1e-9):.0f}/s), "
+                          f"{len(world.entities)} entities, time {world.time}")
+        self.stdout.write(f"digest {digest(world)}")
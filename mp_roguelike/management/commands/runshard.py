@@ -0,0 +1,34 @@
+import asyncio
+import multiprocessing
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from mp_roguelike.sharding import ShardWorker, get_layout
+
+def run_shard(index):
+    layout = get_layout()
+    asyncio.run(ShardWorker(index, layout, settings.ROGUELIKE_SEED).run())
+
+class Command(BaseCommand):
+    help = "Runs a world shard, or every shard in its own process if no index is given."
+
+    def add_arguments(self, parser):
+        parser.add_argument("index", type=int, nargs="?")
+
+    def handle(self, *args, index=None, **options):
+        if not settings.ROGUELIKE_SHARDS:
+            raise CommandError("ROGUELIKE_SHARDS is not set")
+
+        if index is not None:
+            return run_shard(index)
+
+        processes = []
+
+        for index in range(get_layout().count):
+            process = multiprocessing.Process(target=run_shard, args=(index,))
+            process.start()
+            processes.append(process)
+
+        for process in processes:
+            process.join()
@@ -0,0 +1,23 @@
+import numpy as np
+
+# Share of cells that start out as walls, before the cellular automata.
+WALL_CHANCE = 0.4
+
+# Cellular automata steps. Each one only looks at direct neighbours, so a cell
+# depends on the starting noise this many cells around it, and no further.
+GENERATIONS = 4
+
+# One cave smoothing step: cells with more than five walls around them, counting
+# themselves, become walls too. Cells outside the array are thin air, so they
+# never count as walls.
+def run_cellular_automata(walls):
+    height, width = walls.shape
+    padded = np.pad(walls, 1)
+
+    counts = np.zeros(walls.shape, dtype=np.uint8)
+
+    for dy in range(3):
+        for dx in range(3):
+            counts += padded[dy:dy + height, dx:dx + width]
+
+    return walls | (counts > 5)
@@ -0,0 +1,128 @@
+import collections
+import logging
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# How many of the latest tick durations are kept, for percentiles.
+TICK_HISTORY = 1000
+
+# Counters and timers for the hot paths. Recording is a dict lookup and an
+# addition, cheap enough to leave on everywhere but the innermost loops.
+class Metrics:
+    def __init__(self, history=TICK_HISTORY):
+        # Name -> running total.
+        self.counters = collections.defaultdict(int)
+        # Name -> [total seconds, number of observations].
+        self.timers = collections.defaultdict(lambda: [0.0, 0])
+        # Durations of the latest ticks, oldest first.
+        self.ticks = collections.deque(maxlen=history)
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def observe(self, name, seconds):
+        timer = self.timers[name]
+        timer[0] += seconds
+        timer[1] += 1
+
+    def record_tick(self, seconds):
+        self.ticks.append(seconds)
+        self.observe("tick", seconds)
+
+    def tick_percentile(self, fraction):
+        if not self.ticks:
+            return 0.0
+
+        ticks = sorted(self.ticks)
+        return ticks[min(len(ticks) - 1, int(fraction * len(ticks)))]
+
+    # Everything in the Prometheus text exposition format.
+    def render(self):
+        lines = []
+
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"# TYPE roguelike_{name}_total counter")
+            lines.append(f"roguelike_{name}_total {value}")
+
+        for name, (seconds, count) in sorted(self.timers.items()):
+            lines.append(f"# TYPE roguelike_{name}_seconds summary")
+
+            if name == "tick":
+                for fraction in (0.5, 0.9, 0.99):
+                    lines.append(f'roguelike_tick_seconds{{quantile="{fraction}"}} '
+                                 f"{self.tick_percentile(fraction)}")
+
+            lines.append(f"roguelike_{name}_seconds_sum {seconds}")
+            lines.append(f"roguelike_{name}_seconds_count {count}")
+
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+# Samples the stack of the thread running the ticks from a thread of its own,
+# but only once a tick has been running for longer than `threshold' seconds.
+# Fast ticks cost nothing but setting `started'; slow ones are reported to
+# `hook' with how often each stack was seen, as "outer;...;inner" strings that
+# flame graph tools take as they are.
+class SlowTickSampler:
+    def __init__(self, threshold, interval=0.005, hook=None):
+        self.threshold = threshold
+        self.interval = interval
+        self.hook = hook or self.log_samples
+
+        self.thread_id = None
+        self.started = None
+        self.samples = collections.Counter()
+
+        self.thread = None
+
+    def start(self):
+        self.thread_id = threading.get_ident()
+
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True,
+                                           name="slow tick sampler")
+            self.thread.start()
+
+    def tick_started(self):
+        self.started = time.perf_counter()
+
+    def tick_finished(self):
+        duration = time.perf_counter() - self.started
+        self.started = None
+
+        if self.samples:
+            samples, self.samples = self.samples, collections.Counter()
+
+            metrics.count("slow_ticks")
+            self.hook(duration, samples)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+
+            started = self.started
+
+            if started is None or time.perf_counter() - started < self.threshold:
+                continue
+
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+
+            while frame:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+                frame = frame.f_back
+
+            # The tick may have finished while we were looking.
+            if self.started is started:
+                self.samples[";".join(reversed(stack))] += 1
+
+    @staticmethod
+    def log_samples(duration, samples):
+        logger.warning("Slow tick took %.1f ms:\n%s", duration * 1000,
+                       "\n".join(f"{stack} {count}"
+                                 for stack, count in samples.most_common()))
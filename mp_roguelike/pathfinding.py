@@ -0,0 +1,122 @@
+import heapq
+
+from collections import deque
+
+NEIGHBOURS = [
+    (-1, -1), (0, -1), (1, -1),
+    (-1, 0), (1, 0),
+    (-1, 1), (0, 1), (1, 1)
+]
+
+# Moves are 8-directional and cost the same, so the Chebyshev distance is an
+# exact heuristic on an open map.
+def heuristic(x, y, goal):
+    return max(abs(goal[0] - x), abs(goal[1] - y))
+
+# Cells a search may expand before giving up on the goal.
+SEARCH_LIMIT = 10000
+
+# A* search over the tiles. Entities are ignored, since they move around and
+# walking into one is an attack anyway. Returns the path without the starting
+# cell, or None if the goal can't be reached within `limit' expanded cells.
+def find_path(world, start, goal, limit=SEARCH_LIMIT):
+    if start == goal:
+        return []
+
+    if world.is_occupied(*goal):
+        return None
+
+    # Cells in different regions can't reach each other, however long we'd
+    # search. Regions aren't known everywhere, in which case we search anyway.
+    start_region = world.get_region(*start)
+    goal_region = world.get_region(*goal)
+
+    if start_region and goal_region and start_region != goal_region:
+        return None
+
+    came_from = {start: None}
+    cost = {start: 0}
+
+    frontier = [(heuristic(*start, goal), 0, start)]
+
+    expanded = 0
+
+    while frontier and expanded < limit:
+        _, g, current = heapq.heappop(frontier)
+
+        if current == goal:
+            path = []
+
+            while current != start:
+                path.append(current)
+                current = came_from[current]
+
+            path.reverse()
+            return path
+
+        if g > cost[current]:
+            continue
+
+        expanded += 1
+
+        for dx, dy in NEIGHBOURS:
+            x, y = current[0] + dx, current[1] + dy
+
+            if world.is_occupied(x, y):
+                continue
+
+            if (x, y) not in cost or g + 1 < cost[x, y]:
+                cost[x, y] = g + 1
+                came_from[x, y] = current
+                heapq.heappush(frontier, (g + 1 + heuristic(x, y, goal), g + 1, (x, y)))
+
+    return None
+
+# Distance from every cell within `radius' steps to the closest goal, filled in
+# breadth first from all goals at once. One field is shared by every monster
+# chasing the same goals, instead of each of them searching on its own.
+class FlowField:
+    def __init__(self, world, goals, radius):
+        self.world = world
+        self.distances = {}
+
+        queue = deque()
+
+        for goal in goals:
+            if goal not in self.distances:
+                self.distances[goal] = 0
+                queue.append(goal)
+
+        while queue:
+            x, y = cell = queue.popleft()
+            distance = self.distances[cell] + 1
+
+            if distance > radius:
+                continue
+
+            for dx, dy in NEIGHBOURS:
+                neighbour = (x + dx, y + dy)
+
+                if neighbour not in self.distances and not world.is_occupied(*neighbour):
+                    self.distances[neighbour] = distance
+                    queue.append(neighbour)
+
+    def get_distance(self, x, y):
+        return self.distances.get((x, y))
+
+    # The neighbouring cell that leads downhill the fastest, skipping cells
+    # where `is_blocked' says the entity can't go.
+    def next_step(self, x, y, is_blocked=lambda x, y: False):
+        best = None
+        best_distance = self.distances.get((x, y))
+
+        for dx, dy in NEIGHBOURS:
+            distance = self.distances.get((x + dx, y + dy))
+
+            if distance is None or (best_distance is not None and distance >= best_distance):
+                continue
+
+            if not is_blocked(x + dx, y + dy):
+                best, best_distance = (x + dx, y + dy), distance
+
+        return best
@@ -0,0 +1,211 @@
+import json
+import struct
+
+from .util import fields
+
+# Remembers the last viewport sent to a client, so that later updates only
+# carry what changed since then.
+#
+# Entities are sent in world coordinates along with the viewport origin, which
+# lets a moving player scroll the tiles client-side instead of receiving the
+# whole window again.
+class DeltaView:
+    def __init__(self):
+        self.reset()
+
+    # The next encoded frame will be a full keyframe.
+    def reset(self):
+        self.origin = None
+        self.tiles = None
+        self.entities = {}
+        self.player = None
+
+    def encode(self, entity):
+        origin = [entity.x - entity.view_radius, entity.y - entity.view_radius]
+        tiles = entity.get_visible_tiles()
+        player = entity.stripped()
+
+        entities = {}
+
+        for other in entity.get_visible_entities():
+            entities[other.id] = other.stripped()
+
+        if self.tiles is None or len(self.tiles) != len(tiles):
+            frames = [("keyframe", {
+                "origin": origin,
+                "tiles": tiles,
+                "entities": list(entities.values()),
+                "player": player
+            })]
+        else:
+            frames = self.__patch(origin, tiles, entities, player)
+
+        self.origin = origin
+        self.tiles = tiles
+        self.entities = entities
+        self.player = player
+
+        return frames
+
+    def __patch(self, origin, tiles, entities, player):
+        patch = {}
+
+        if origin != self.origin:
+            patch["origin"] = origin
+
+        changed = self.__diff_tiles(origin, tiles)
+
+        if changed:
+            patch["tiles"] = changed
+
+        spawned = []
+        moved = []
+        hp = []
+
+        for id, other in entities.items():
+            old = self.entities.get(id)
+
+            if old is None:
+                spawned.append(other)
+                continue
+
+            if old["x"] != other["x"] or old["y"] != other["y"]:
+                moved.append([id, other["x"], other["y"]])
+
+            if old["hp"] != other["hp"]:
+                hp.append([id, other["hp"]])
+
+        removed = [id for id in self.entities if id not in entities]
+
+        for key, value in (("spawned", spawned), ("moved", moved),
+                           ("hp", hp), ("removed", removed)):
+            if value:
+                patch[key] = value
+
+        if player != self.player:
+            patch["player"] = player
+
+        return [("patch", patch)] if patch else []
+
+    # Tiles are compared against the previous window shifted by the change of
+    # origin, which is exactly what the client does before applying the patch.
+    # Appearances are shared flyweights, so identity is enough to compare them.
+    def __diff_tiles(self, origin, tiles):
+        dx = origin[0] - self.origin[0]
+        dy = origin[1] - self.origin[1]
+
+        size = len(tiles)
+        changed = []
+
+        for y, row in enumerate(tiles):
+            old_y = y + dy
+            old_row = self.tiles[old_y] if 0 <= old_y < size else None
+
+            for x, tile in enumerate(row):
+                old_x = x + dx
+
+                if old_row is None or not 0 <= old_x < size \
+                   or old_row[old_x] is not tile:
+                    changed.append([x, y, tile])
+
+        return changed
+
+# Every distinct tile appearance ever rendered, so that binary frames can refer
+# to them by index. Appearances are flyweights that live as long as the world,
+# which makes their identity a stable key.
+class Palette:
+    def __init__(self):
+        self.entries = []
+        self.indices = {}
+
+    def index(self, appearance):
+        key = id(appearance)
+
+        if key not in self.indices:
+            self.indices[key] = len(self.entries)
+            self.entries.append(appearance)
+
+        return self.indices[key]
+
+palette = Palette()
+
+FRAME_VIEWPORT = 1
+
+# Header: frame type, viewport origin, viewport size, length of the RLE data.
+FRAME_HEADER = struct.Struct("<BiiHI")
+# A run of cells sharing one palette index.
+FRAME_RUN = struct.Struct("<BH")
+
+# Sends full viewports as binary frames: the tiles are run-length encoded
+# palette indices, followed by the entities and player stats as JSON. Palette
+# entries are sent once as a text event, before the first frame using them.
+class BinaryView:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.palette_size = 0
+
+    def encode(self, entity):
+        frames = []
+
+        tiles = entity.get_visible_tiles()
+        indices = [palette.index(tile) for row in tiles for tile in row]
+
+        if len(palette.entries) > self.palette_size:
+            frames.append(("palette", {
+                "start": self.palette_size,
+                "entries": palette.entries[self.palette_size:]
+            }))
+
+            self.palette_size = len(palette.entries)
+
+        runs = self.__encode_runs(indices)
+
+        entities = []
+
+        for other in entity.get_visible_entities():
+            other = other.stripped()
+
+            other["x"] += entity.view_radius - entity.x
+            other["y"] += entity.view_radius - entity.y
+
+            entities.append(other)
+
+        tail = json.dumps({
+            "entities": entities,
+            "player": entity.stripped()
+        }, default=fields).encode()
+
+        header = FRAME_HEADER.pack(FRAME_VIEWPORT,
+                                   entity.x - entity.view_radius,
+                                   entity.y - entity.view_radius,
+                                   len(tiles), len(runs))
+
+        frames.append(header + runs + tail)
+
+        return frames
+
+    def __encode_runs(self, indices):
+        runs = bytearray()
+
+        if not indices:
+            return runs
+
+        current, length = indices[0], 0
+
+        for index in indices:
+            if index != current or length == 255:
+                runs += FRAME_RUN.pack(length, current)
+                current, length = index, 0
+
+            length += 1
+
+        runs += FRAME_RUN.pack(length, current)
+
+        return runs
+
+PROTOCOLS = {
+    "delta": DeltaView,
+    "binary": BinaryView
+}
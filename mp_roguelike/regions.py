@@ -0,0 +1,228 @@
+import numpy as np
+
+# The eight cells around one, in order around the ring.
+RING = [(-1, -1), (0, -1), (1, -1), (1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0)]
+
+# Labels the connected regions of passable cells, connected the way entities
+# move: in eight directions. Returns the labels, zero for impassable cells and
+# counting up from one, and the size of each region by label.
+#
+# Works on horizontal runs of passable cells rather than cells: the runs in
+# touching rows are joined by union-find, hooking roots onto lower roots they
+# touch and then pointer jumping, all of it on whole arrays at once.
+def label_regions(passable):
+    height, width = passable.shape
+
+    starts = passable.copy()
+    starts[:, 1:] &= ~passable[:, :-1]
+
+    runs = np.where(passable, np.cumsum(starts, dtype=np.int32).reshape(height, width), 0)
+    count = int(runs.max(initial=0))
+
+    # Runs touching across rows. Two runs touch over many columns, but the
+    # first one will do.
+    upper, lower = runs[:-1], runs[1:]
+
+    touching = (upper > 0) & (lower > 0)
+    touching[:, 1:] &= (upper[:, 1:] != upper[:, :-1]) | (lower[:, 1:] != lower[:, :-1])
+
+    pairs = [(upper[touching], lower[touching])]
+
+    # Diagonally, which only adds anything where two runs meet at a corner
+    # and nowhere else.
+    for left, right in ((upper, lower), (lower, upper)):
+        corner = (left[:, :-1] > 0) & (right[:, 1:] > 0) \
+            & (right[:, :-1] == 0) & (left[:, 1:] == 0)
+
+        pairs.append((left[:, :-1][corner], right[:, 1:][corner]))
+
+    a = np.concatenate([first for first, second in pairs])
+    b = np.concatenate([second for first, second in pairs])
+
+    parent = np.arange(count + 1, dtype=np.int32)
+
+    while True:
+        while True:
+            jumped = parent[parent]
+
+            if (jumped == parent).all():
+                break
+
+            parent = jumped
+
+        roots_a, roots_b = parent[a], parent[b]
+        apart = roots_a != roots_b
+
+        if not apart.any():
+            break
+
+        # Pairs already joined stay joined.
+        a, b = a[apart], b[apart]
+        roots_a, roots_b = roots_a[apart], roots_b[apart]
+
+        # Hook the higher root onto the lower one. Where a root is hooked
+        # several ways at once, whichever write wins is as good as any: all
+        # links point to lower runs, so they never form a cycle, and the pairs
+        # that lost are still apart for the next round.
+        parent[np.maximum(roots_a, roots_b)] = np.minimum(roots_a, roots_b)
+
+    # Roots are numbered in order, so run zero, the impassable cells, stays
+    # label zero.
+    is_root = parent == np.arange(count + 1)
+    compact = (np.cumsum(is_root, dtype=np.int32) - 1)[parent]
+    labels = compact[runs]
+
+    sizes = np.bincount(labels.ravel(), minlength=int(is_root.sum()))
+    sizes[0] = 0
+
+    return labels, sizes
+
+# The connected regions of a map, kept up to date cell by cell as it changes,
+# and the cells of the largest one, for placing entities where they can reach
+# most of the map.
+class Regions:
+    def __init__(self, passable):
+        self.height, self.width = passable.shape
+
+        labels, sizes = label_regions(passable)
+
+        # Flat, one label per cell, like the tile grid.
+        self.labels = labels.ravel()
+        self.sizes = sizes.tolist()
+
+        self.rebuild_cells()
+
+    # The pool of cells to place entities in. Cells that leave the largest
+    # region stay in it until the next rebuild, and are skipped when picked.
+    def rebuild_cells(self):
+        self.largest = max(range(len(self.sizes)), key=self.sizes.__getitem__)
+
+        self.cells = np.flatnonzero(self.labels == self.largest) if self.largest \
+            else np.zeros(0, dtype=np.intp)
+        self.count = len(self.cells)
+        self.stale = 0
+
+    def label_at(self, x, y):
+        if x < 0 or y < 0 or x >= self.width or y >= self.height:
+            return 0
+
+        return int(self.labels[y * self.width + x])
+
+    # A cell of the largest region, as a flat index, or None if there is no
+    # passable cell at all.
+    def random_cell(self, rng):
+        while self.count:
+            i = int(self.cells[rng.randrange(self.count)])
+
+            if self.labels[i] == self.largest:
+                return i
+
+        return None
+
+    # The cell at (x, y) became passable: it joins the regions around it,
+    # merging them into the biggest of them.
+    def open(self, x, y):
+        i = y * self.width + x
+
+        if self.labels[i]:
+            return
+
+        around = {self.label_at(x + dx, y + dy) for dx, dy in RING} - {0}
+
+        if around:
+            label = max(around, key=self.sizes.__getitem__)
+        else:
+            label = len(self.sizes)
+            self.sizes.append(0)
+
+        merged = around - {label}
+
+        for other in merged:
+            self.labels[self.labels == other] = label
+            self.sizes[label] += self.sizes[other]
+            self.sizes[other] = 0
+
+        self.labels[i] = label
+        self.sizes[label] += 1
+
+        if merged or self.sizes[label] > self.sizes[self.largest]:
+            self.rebuild_cells()
+        elif label == self.largest:
+            self.add_cell(i)
+
+    def add_cell(self, i):
+        if self.count == len(self.cells):
+            self.cells = np.resize(self.cells, max(2 * self.count, 16))
+
+        self.cells[self.count] = i
+        self.count += 1
+
+    # The cell at (x, y) became impassable. Its region is only relabelled if
+    # that might have cut it in two.
+    def close(self, x, y):
+        i = y * self.width + x
+        label = int(self.labels[i])
+
+        if not label:
+            return
+
+        self.labels[i] = 0
+        self.sizes[label] -= 1
+
+        if label == self.largest:
+            self.stale += 1
+
+        if self.may_split(x, y):
+            self.split(label)
+        elif self.stale * 2 > self.count:
+            self.rebuild_cells()
+
+    # Whether the passable cells around (x, y) aren't all connected to each
+    # other without it. Neighbours next to each other in the ring touch, and
+    # so do the straight neighbours on either side of a corner.
+    def may_split(self, x, y):
+        is_open = [self.label_at(x + dx, y + dy) > 0 for dx, dy in RING]
+        seen = set()
+        groups = 0
+
+        for start in range(8):
+            if not is_open[start] or start in seen:
+                continue
+
+            groups += 1
+            stack = [start]
+            seen.add(start)
+
+            while stack:
+                k = stack.pop()
+                links = [(k + 1) % 8, (k - 1) % 8]
+
+                # Odd positions are the straight neighbours.
+                if k % 2:
+                    links += [(k + 2) % 8, (k - 2) % 8]
+
+                for other in links:
+                    if is_open[other] and other not in seen:
+                        seen.add(other)
+                        stack.append(other)
+
+        return groups > 1
+
+    # Relabels the region, which keeps its label for its biggest part.
+    def split(self, label):
+        inside = self.labels == label
+        parts, sizes = label_regions(inside.reshape(self.height, self.width))
+
+        if len(sizes) > 2:
+            biggest = int(np.argmax(sizes))
+            parts = parts.ravel()[inside]
+
+            # Parts other than the biggest get new labels after the others.
+            new = len(self.sizes) + parts - 1 - (parts > biggest)
+            self.labels[inside] = np.where(parts == biggest, label, new)
+
+            self.sizes[label] = int(sizes[biggest])
+            self.sizes.extend(int(size) for k, size in enumerate(sizes)
+                              if k and k != biggest)
+
+        self.rebuild_cells()
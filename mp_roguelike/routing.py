@@ -1,14 +1,46 @@
 from channels.auth import AuthMiddlewareStack
 from channels.routing import ProtocolTypeRouter, URLRouter
 
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.exceptions import ImproperlyConfigured
 from django.urls import re_path
 
-from . import consumers
+from . import consumers, sharding
+from .world import world
+from .loop import game_loop
+
+if settings.ROGUELIKE_ENTITY_STORE:
+    world.enable_store()
+
+if settings.ROGUELIKE_SHARDS:
+    consumer = sharding.ShardedRoguelikeConsumer
+else:
+    consumer = consumers.RoguelikeConsumer
+
+    if settings.ROGUELIKE_CHUNKED:
+        if settings.ROGUELIKE_SNAPSHOT:
+            raise ImproperlyConfigured("ROGUELIKE_CHUNKED worlds can't be snapshotted")
+
+        width, height = (int(n) for n in settings.ROGUELIKE_CHUNKED.lower().split("x"))
+        world.enable_chunks(width, height, settings.ROGUELIKE_CHUNK_BUDGET,
+                            settings.ROGUELIKE_CHUNK_DIR)
+
+    if settings.ROGUELIKE_SNAPSHOT:
+        game_loop.enable_snapshots(settings.ROGUELIKE_SNAPSHOT,
+                                   settings.ROGUELIKE_SNAPSHOT_INTERVAL,
+                                   settings.ROGUELIKE_TURN_LOG)
+    elif settings.ROGUELIKE_TURN_LOG:
+        game_loop.enable_turn_log(settings.ROGUELIKE_TURN_LOG)
+
+    if settings.ROGUELIKE_SLOW_TICK:
+        game_loop.enable_slow_tick_sampler(settings.ROGUELIKE_SLOW_TICK)
 
 urlpatterns = [
-    re_path("server/", consumers.RoguelikeConsumer)
+    re_path("server/", consumer.as_asgi())
 ]
 
 application = ProtocolTypeRouter({
+    'http': get_asgi_application(),
     'websocket': AuthMiddlewareStack(URLRouter(urlpatterns))
 })
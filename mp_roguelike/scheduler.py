@@ -0,0 +1,48 @@
+import heapq
+import itertools
+
+# Energy an entity spends on one action. An entity of speed `s' gains `s'
+# energy per tick, so it acts every `ACTION_COST / s' ticks.
+ACTION_COST = 100
+
+# The speed everyone has unless told otherwise: one action per 10 ticks.
+NORMAL_SPEED = 10
+
+# Ticks a player may stay idle once their turn comes before it is passed.
+PLAYER_TURN_TIMEOUT = 30
+
+def turn_delay(speed):
+    return max(1, -(-ACTION_COST // speed))
+
+# Entities ordered by the tick they act next. Entries are never removed from the
+# heap: rescheduling an entity or taking it out of the world leaves its old
+# entry behind, which is skipped once it reaches the top.
+class Scheduler:
+    def __init__(self):
+        self.queue = []
+        self.order = itertools.count()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def schedule(self, entity, time):
+        entity.next_turn = time
+        entity.turn_ticket = next(self.order)
+
+        heapq.heappush(self.queue, (time, entity.turn_ticket, entity))
+
+    def unschedule(self, entity):
+        entity.turn_ticket = None
+
+    # Pops the entities due at or before `time', in the order they became due.
+    def pop_due(self, time):
+        due = []
+
+        while self.queue and self.queue[0][0] <= time:
+            _, ticket, entity = heapq.heappop(self.queue)
+
+            if ticket == entity.turn_ticket:
+                entity.turn_ticket = None
+                due.append(entity)
+
+        return due
@@ -66,6 +66,58 @@ AUTH_PASSWORD_VALIDATORS = [
 
 ASGI_APPLICATION = 'mp_roguelike.routing.application'
 
+REDIS_URL = os.getenv("REDIS_URL")
+
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {
+                "hosts": [REDIS_URL]
+            }
+        }
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer"
+        }
+    }
+
+# Splits the world between shard processes as a grid of regions, e.g. "2x2".
+# Every shard is started with `manage.py runshard', and they need a channel
+# layer shared between processes, i.e. REDIS_URL.
+ROGUELIKE_SHARDS = os.getenv("ROGUELIKE_SHARDS")
+
+# Seed for the world map. Shards need the same one to agree on the map.
+ROGUELIKE_SEED = int(os.getenv("ROGUELIKE_SEED") or 0)
+
+# Keep entities in NumPy columns as well, so that monsters pick their targets
+# in bulk. Worth it with thousands of monsters awake at once.
+ROGUELIKE_ENTITY_STORE = bool(os.getenv("ROGUELIKE_ENTITY_STORE"))
+
+# Map size as WIDTHxHEIGHT for a world made of chunks that are generated as
+# players come near them, rather than all at once. Memory then grows with how
+# much of the map players are near, up to ROGUELIKE_CHUNK_BUDGET chunks of
+# 32x32 cells; changed chunks over the budget are swapped out to a temporary
+# directory under ROGUELIKE_CHUNK_DIR. Can't be combined with snapshots.
+ROGUELIKE_CHUNKED = os.getenv("ROGUELIKE_CHUNKED")
+ROGUELIKE_CHUNK_BUDGET = int(os.getenv("ROGUELIKE_CHUNK_BUDGET") or 1024)
+ROGUELIKE_CHUNK_DIR = os.getenv("ROGUELIKE_CHUNK_DIR")
+
+# File the world is kept in between restarts: loaded on boot if it exists, and
+# saved in the background every ROGUELIKE_SNAPSHOT_INTERVAL seconds.
+ROGUELIKE_SNAPSHOT = os.getenv("ROGUELIKE_SNAPSHOT")
+ROGUELIKE_SNAPSHOT_INTERVAL = float(os.getenv("ROGUELIKE_SNAPSHOT_INTERVAL") or 60)
+
+# File every player action is appended to, for replaying it with
+# `manage.py replay' or recovering what happened after the last snapshot.
+ROGUELIKE_TURN_LOG = os.getenv("ROGUELIKE_TURN_LOG")
+
+# Ticks taking longer than this many seconds get their stacks sampled and
+# logged, for finding out why.
+ROGUELIKE_SLOW_TICK = float(os.getenv("ROGUELIKE_SLOW_TICK") or 0) or None
+
 LANGUAGE_CODE = 'en-us'
 
 TIME_ZONE = 'UTC'
@@ -0,0 +1,538 @@
+import asyncio
+import itertools
+import logging
+import random
+
+from collections import deque
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .util import Die
+from .world import World, world
+from .tiles import Tile
+from .entities import Entity
+from .protocol import PROTOCOLS
+from .consumers import Player, Session, RoguelikeConsumer, PLAYER_COLORS, \
+    parse_turn
+from .loop import PLAYERS_GROUP, TICK_INTERVAL, INTENT_LIMIT
+from .metrics import metrics
+from . import ai
+
+logger = logging.getLogger(__name__)
+
+# How far past its region a shard mirrors its neighbours' entities. Must cover
+# the largest view radius, so nobody near an edge sees a gap.
+HALO = 10
+
+def shard_channel(index):
+    return f"shard.{index}"
+
+def get_layout():
+    return Layout.parse(world.width, world.height, settings.ROGUELIKE_SHARDS)
+
+# Splits the map into a grid of equally sized rectangular regions, one per shard.
+class Layout:
+    def __init__(self, width, height, columns, rows):
+        self.width = width
+        self.height = height
+        self.columns = columns
+        self.rows = rows
+
+    @classmethod
+    def parse(cls, width, height, spec):
+        columns, rows = (int(n) for n in spec.lower().split("x"))
+        return cls(width, height, columns, rows)
+
+    @property
+    def count(self):
+        return self.columns * self.rows
+
+    def region(self, index):
+        column, row = index % self.columns, index // self.columns
+
+        return (self.width * column // self.columns,
+                self.height * row // self.rows,
+                self.width * (column + 1) // self.columns,
+                self.height * (row + 1) // self.rows)
+
+    def owner_of(self, x, y):
+        column = min(max(x * self.columns // self.width, 0), self.columns - 1)
+        row = min(max(y * self.rows // self.height, 0), self.rows - 1)
+
+        return row * self.columns + column
+
+    # Shards whose region lies within `margin' cells of the given one.
+    def neighbours(self, index, margin):
+        x0, y0, x1, y1 = self.region(index)
+
+        for other in range(self.count):
+            ox0, oy0, ox1, oy1 = self.region(other)
+
+            if other != index and ox0 < x1 + margin and x0 - margin < ox1 \
+               and oy0 < y1 + margin and y0 - margin < oy1:
+                yield other
+
+class GhostAI(ai.AI):
+    __slots__ = ()
+
+    def think(self):
+        self.entity.turn_done = True
+
+# A read-only mirror of an entity owned by a neighbouring shard. Damage dealt to
+# it is forwarded to the owner, which stays the authority on its hit points.
+class Ghost(Entity):
+    __slots__ = ("worker", "owner")
+
+    def __init__(self, worker, owner, state):
+        super().__init__({
+            "name": state["name"],
+            "character": state["character"],
+            "color": state["color"],
+            "view_radius": state["view_radius"],
+            "ai_type": ai.ControlledAI if state["controlled"] else GhostAI,
+            # Ghosts are moved by their owner and never take turns here.
+            "speed": 0
+        })
+
+        self.worker = worker
+        self.owner = owner
+
+        self.id = state["id"]
+        self.hp = state["hp"]
+        self.x, self.y = state["x"], state["y"]
+        self.turn_done = True
+
+    def damage(self, dmg):
+        attacker = self.attacked_by
+
+        self.worker.send(shard_channel(self.owner), {
+            "type": "shard.damage",
+            "id": self.id,
+            "dmg": dmg,
+            "attacker": [attacker.name, attacker.character, attacker.color]
+        })
+
+def serialize_entity(entity):
+    return {
+        "id": entity.id,
+        "name": entity.name,
+        "character": entity.character,
+        "color": entity.color,
+        "x": entity.x,
+        "y": entity.y,
+        "hp": entity.hp,
+        "view_radius": entity.view_radius,
+        "attack_roll": [entity.attack_roll.count, entity.attack_roll.sides,
+                        entity.attack_roll.inc],
+        "controlled": isinstance(entity.ai, ai.ControlledAI)
+    }
+
+def deserialize_entity(state):
+    entity = Entity({
+        "name": state["name"],
+        "character": state["character"],
+        "color": state["color"],
+        "view_radius": state["view_radius"],
+        "attack_roll": Die(*state["attack_roll"]),
+        "ai_type": ai.ControlledAI if state["controlled"] else ai.AggressiveAI
+    })
+
+    entity.id = state["id"]
+    entity.hp = state["hp"]
+    entity.x, entity.y = state["x"], state["y"]
+
+    return entity
+
+# Stands in for the websocket consumer of a player simulated by a shard: frames
+# are relayed to the frontend consumer holding the actual connection.
+class RemoteSession(Session):
+    def __init__(self, worker, channel_name, protocol):
+        self.worker = worker
+        self.world = worker.world
+        self.channel_name = channel_name
+        self.protocol = protocol
+
+        if protocol in PROTOCOLS:
+            self.view = PROTOCOLS[protocol]()
+
+        self.player = None
+        # Turns waiting to be applied, one per tick like on the game loop.
+        self.intents = deque()
+
+    def send_frame(self, text_data=None, bytes_data=None):
+        metrics.count("frames_sent")
+        metrics.count("bytes_sent", len(bytes_data) if bytes_data is not None
+                      else len(text_data.encode()))
+
+        self.worker.send(self.channel_name, {
+            "type": "shard.frame",
+            "text_data": text_data,
+            "bytes_data": bytes_data
+        })
+
+    def send_message_to_all(self, sender, text):
+        self.worker.group_send(PLAYERS_GROUP, {
+            "type": "shard.frame",
+            "text_data": self.encode("message", {
+                "sender": sender,
+                "text": text
+            }),
+            "bytes_data": None
+        })
+
+# Simulates the part of the world inside one region. Entities that walk out of
+# it are handed off to the owning shard, and entities near the edges are
+# mirrored to the neighbours as ghosts every tick.
+class ShardWorker:
+    def __init__(self, index, layout, seed, channel_layer=None):
+        self.index = index
+        self.layout = layout
+        self.region = layout.region(index)
+        self.channel = shard_channel(index)
+        self.channel_layer = channel_layer or get_channel_layer()
+
+        # Keep entity ids unique across shards, as they travel between them.
+        Entity.ids = itertools.count(index << 32)
+
+        self.world = World(layout.width, layout.height, seed)
+        self.world.generate()
+
+        for entity in list(self.world.entities):
+            if not self.owns(entity.x, entity.y):
+                self.world.remove_entity(entity)
+
+        if settings.ROGUELIKE_ENTITY_STORE:
+            self.world.enable_store()
+
+        # Frontend channel name -> RemoteSession.
+        self.sessions = {}
+        # Sessions handed off to another shard, for forwarding late messages.
+        self.handed_off = {}
+
+        # Shard index -> ghosts mirrored from it.
+        self.ghosts = {}
+        self.sent_halos = {}
+
+        self.inbox = []
+        self.outbox = []
+
+        self.handlers = {
+            "shard.join": self.on_join,
+            "shard.leave": self.on_leave,
+            "shard.intent": self.on_intent,
+            "shard.chat": self.on_chat,
+            "shard.keyframe": self.on_keyframe,
+            "shard.handoff": self.on_handoff,
+            "shard.halo": self.on_halo,
+            "shard.damage": self.on_damage
+        }
+
+    def owns(self, x, y):
+        x0, y0, x1, y1 = self.region
+        return x0 <= x < x1 and y0 <= y < y1
+
+    def send(self, channel, message):
+        self.outbox.append((False, channel, message))
+
+    def group_send(self, group, message):
+        self.outbox.append((True, group, message))
+
+    def is_ghost(self, entity):
+        return isinstance(entity, Ghost)
+
+    def find_entity(self, id):
+        for entity in self.world.entities:
+            if entity.id == id and not self.is_ghost(entity):
+                return entity
+
+    # Returns the session for a message, forwarding the message to the new
+    # owner instead if the player has moved on.
+    def get_session(self, message):
+        session = message["session"]
+
+        if session in self.handed_off:
+            self.send(shard_channel(self.handed_off[session]), message)
+            return None
+
+        return self.sessions.get(session)
+
+    def on_join(self, message):
+        session = RemoteSession(self, message["session"], message["protocol"])
+        self.sessions[session.channel_name] = session
+
+        color = PLAYER_COLORS[len(self.sessions) % len(PLAYER_COLORS)]
+        session.player = Player(session, message["name"], color)
+        session.player.respawn()
+
+        welcome_msg = f"{session.player.entity.fancy_name} joined the game"
+        session.send_message_to_all("Server", welcome_msg)
+
+    def on_leave(self, message):
+        owner = self.handed_off.pop(message["session"], None)
+
+        # The player may have left before hearing about the handoff, in which
+        # case the new owner doesn't know yet.
+        if owner is not None:
+            self.send(shard_channel(owner), message)
+            return
+
+        session = self.sessions.get(message["session"])
+
+        if session:
+            goodbye_msg = f"{session.player.entity.fancy_name} disconnected"
+            session.send_message_to_all("Server", goodbye_msg)
+
+            session.player.leave()
+            del self.sessions[session.channel_name]
+
+    def on_intent(self, message):
+        session = self.get_session(message)
+
+        if not session:
+            return
+
+        turn = parse_turn(message["turn"])
+
+        if not turn:
+            return
+
+        if len(session.intents) >= INTENT_LIMIT:
+            metrics.count("intents_dropped")
+        else:
+            session.intents.append(turn)
+
+    def on_chat(self, message):
+        session = self.get_session(message)
+
+        if session and message["message"]:
+            session.send_message_to_all(session.player.entity.fancy_name,
+                                        message["message"])
+
+    def on_keyframe(self, message):
+        session = self.get_session(message)
+
+        if session and session.view:
+            session.view.reset()
+            session.player.mark_dirty()
+
+    def on_handoff(self, message):
+        entity = deserialize_entity(message["entity"])
+        self.world.add_entity(entity)
+
+        if "session" not in message:
+            return
+
+        session = RemoteSession(self, message["session"], message["protocol"])
+        self.sessions[session.channel_name] = session
+        self.handed_off.pop(session.channel_name, None)
+
+        session.player = Player(session, entity.name, entity.color)
+        session.player.attach(entity)
+
+    def on_halo(self, message):
+        for ghost in self.ghosts.pop(message["shard"], []):
+            self.world.remove_entity(ghost)
+
+        ghosts = []
+
+        for state in message["entities"]:
+            ghost = Ghost(self, message["shard"], state)
+            self.world.add_entity(ghost)
+            ghosts.append(ghost)
+
+        self.ghosts[message["shard"]] = ghosts
+
+    def on_damage(self, message):
+        entity = self.find_entity(message["id"])
+
+        if entity:
+            entity.attacked_by = Tile(*message["attacker"])
+            entity.damage(message["dmg"])
+
+    def hand_off(self):
+        for entity in list(self.world.entities):
+            if self.is_ghost(entity) or self.owns(entity.x, entity.y):
+                continue
+
+            owner = self.layout.owner_of(entity.x, entity.y)
+            message = {
+                "type": "shard.handoff",
+                "entity": serialize_entity(entity)
+            }
+
+            session = self.find_session(entity)
+
+            if session:
+                message["session"] = session.channel_name
+                message["protocol"] = session.protocol
+
+                session.player.leave()
+                del self.sessions[session.channel_name]
+                self.handed_off[session.channel_name] = owner
+
+                self.send(session.channel_name, {
+                    "type": "shard.routed",
+                    "shard": owner
+                })
+            else:
+                self.disown(entity)
+                self.world.remove_entity(entity)
+
+            self.send(shard_channel(owner), message)
+
+    # Monsters leaving for another shard never die here, so their spawner
+    # would wait for them forever.
+    def disown(self, entity):
+        for other in self.world.entities:
+            if isinstance(other.ai, ai.SpawnerAI):
+                other.ai.disown(entity)
+
+    def find_session(self, entity):
+        for session in self.sessions.values():
+            if session.player.entity is entity:
+                return session
+
+    def send_halos(self):
+        for neighbour in self.layout.neighbours(self.index, HALO):
+            x0, y0, x1, y1 = self.layout.region(neighbour)
+
+            entities = []
+
+            for entity in self.world.entities:
+                if self.is_ghost(entity):
+                    continue
+
+                if x0 - HALO <= entity.x < x1 + HALO \
+                   and y0 - HALO <= entity.y < y1 + HALO:
+                    entities.append(serialize_entity(entity))
+
+            if self.sent_halos.get(neighbour) != entities:
+                self.sent_halos[neighbour] = entities
+
+                self.send(shard_channel(neighbour), {
+                    "type": "shard.halo",
+                    "shard": self.index,
+                    "entities": entities
+                })
+
+    def tick(self):
+        messages, self.inbox = self.inbox, []
+
+        # One client's bad input mustn't stop the shard for everyone.
+        for message in messages:
+            if message["type"] in self.handlers:
+                try:
+                    self.handlers[message["type"]](message)
+                except Exception:
+                    logger.exception("Shard message %r failed", message["type"])
+                    metrics.count("intents_failed")
+
+        for session in self.sessions.values():
+            if session.intents and session.player.can_take_turn():
+                try:
+                    session.player.take_turn(*session.intents.popleft())
+                except Exception:
+                    logger.exception("Intent failed")
+                    metrics.count("intents_failed")
+
+        self.world.update()
+
+        self.hand_off()
+        self.send_halos()
+        self.world.flush_changes()
+
+        for session in self.sessions.values():
+            if session.player.dirty:
+                session.player.dirty = False
+                session.update()
+
+    async def receive(self):
+        while True:
+            message = await self.channel_layer.receive(self.channel)
+            self.inbox.append(message)
+
+    async def flush(self):
+        outbox, self.outbox = self.outbox, []
+
+        for is_group, target, message in outbox:
+            if is_group:
+                await self.channel_layer.group_send(target, message)
+            else:
+                await self.channel_layer.send(target, message)
+
+    async def run(self):
+        receiver = asyncio.ensure_future(self.receive())
+        clock = asyncio.get_running_loop()
+
+        try:
+            while True:
+                started = clock.time()
+
+                self.tick()
+                await self.flush()
+
+                elapsed = clock.time() - started
+                metrics.record_tick(elapsed)
+                await asyncio.sleep(max(0, TICK_INTERVAL - elapsed))
+        finally:
+            receiver.cancel()
+
+# Frontend for a sharded world: owns the websocket, but leaves the simulation to
+# the shard currently owning the player, following it across handoffs.
+class ShardedRoguelikeConsumer(RoguelikeConsumer):
+    game_loop = None
+
+    async def send_to_shard(self, message, shard=None):
+        message["session"] = self.channel_name
+        await self.channel_layer.send(
+            shard_channel(self.shard if shard is None else shard), message)
+
+    # Every shard the player was handed off by remembers where it went, until
+    # told the player left.
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(PLAYERS_GROUP, self.channel_name)
+
+        if hasattr(self, "shard"):
+            for shard in self.shards:
+                await self.send_to_shard({"type": "shard.leave"}, shard)
+
+        self.writer.cancel()
+
+    async def shard_frame(self, event):
+        self.send_frame(text_data=event["text_data"],
+                        bytes_data=event["bytes_data"])
+
+    async def shard_routed(self, event):
+        self.shard = event["shard"]
+        self.shards.add(self.shard)
+
+    async def world_tick(self, event):
+        pass
+
+    async def on_auth(self, data):
+        if not data or "name" not in data:
+            return await self.close()
+
+        # The shard spawns the player wherever there is room, and hands it off
+        # to the actual owner right away if needed.
+        self.shard = random.randrange(get_layout().count)
+        self.shards = {self.shard}
+
+        await self.send_to_shard({
+            "type": "shard.join",
+            "name": data["name"] or f"Guest{random.randint(1, 10000):04}",
+            "protocol": data.get("protocol")
+        })
+
+    async def on_turn(self, data):
+        await self.send_to_shard({"type": "shard.intent", "turn": data})
+
+    async def on_keyframe(self, data):
+        await self.send_to_shard({"type": "shard.keyframe"})
+
+    async def on_chat(self, data):
+        await self.send_to_shard({
+            "type": "shard.chat",
+            "message": data["message"]
+        })
@@ -0,0 +1,246 @@
+import collections
+import itertools
+import json
+import mmap
+import os
+import struct
+import zlib
+
+from .util import Die, fields
+from .tiles import Tile, Floor, Wall
+from .entities import Entity, Spawner
+from .scheduler import Scheduler
+from .world import SPAWN_FUNS
+from . import ai
+
+# A snapshot file is a header, the tile grid and the glyph masks as raw bytes,
+# one per cell, and everything else as compressed JSON. The grids sit at fixed
+# offsets, so loading maps them straight from the file instead of reading them.
+MAGIC = b"MPRL"
+VERSION = 1
+
+# Magic, format version, width, height.
+HEADER = struct.Struct("<4sHII")
+
+TILE_TYPES = {cls.__name__: cls for cls in [Tile, Floor, Wall]}
+AI_TYPES = {cls.__name__: cls
+            for cls in [ai.ControlledAI, ai.AggressiveAI, ai.SpawnerAI]}
+
+def save_tile(tile):
+    return [type(tile).__name__, fields(tile)]
+
+def load_tile(state):
+    cls, attributes = state
+
+    tile = TILE_TYPES[cls].__new__(TILE_TYPES[cls])
+
+    for name, value in attributes.items():
+        setattr(tile, name, value)
+
+    return tile
+
+def save_entity(world, entity):
+    roll = entity.attack_roll
+
+    state = {
+        "id": entity.id,
+        "name": entity.name,
+        "character": entity.character,
+        "color": entity.color,
+        "x": entity.x,
+        "y": entity.y,
+        "hp": entity.hp,
+        "view_radius": entity.view_radius,
+        "attack_roll": [roll.count, roll.sides, roll.inc],
+        "speed": entity.speed,
+        "next_turn": entity.next_turn,
+        "turn_ticket": entity.turn_ticket,
+        "turn_done": entity.turn_done,
+        "ai": type(entity.ai).__name__
+    }
+
+    # Only players queue turns ahead of theirs, and those are always moves.
+    turn = world.queued_turns.get(entity)
+
+    if turn:
+        state["queued_move"] = turn.args[:2]
+
+    # Players travelling somewhere, mostly.
+    if entity.ai.queued_path:
+        state["path"] = list(entity.ai.queued_path)
+        state["path_goal"] = entity.ai.path_goal
+
+    if isinstance(entity.ai, ai.AggressiveAI):
+        state["last_seen"] = entity.ai.last_seen
+
+    if isinstance(entity.ai, ai.SpawnerAI):
+        state["spawner"] = {
+            "spawn_fun": entity.ai.spawn_fun.__name__,
+            "max_spawn": entity.ai.max_spawn,
+            "spawn_cooldown": entity.ai.spawn_cooldown,
+            "last_spawn_time": entity.ai.last_spawn_time,
+            "spawned": [spawned.id for spawned in entity.ai.spawned]
+        }
+
+    return state
+
+def load_entity(state):
+    params = {
+        "name": state["name"],
+        "character": state["character"],
+        "color": state["color"],
+        "view_radius": state["view_radius"],
+        "attack_roll": Die(*state["attack_roll"]),
+        "speed": state["speed"],
+        "ai_type": AI_TYPES[state["ai"]]
+    }
+
+    if "spawner" in state:
+        spawner = state["spawner"]
+
+        params["spawn_fun"] = SPAWN_FUNS[spawner["spawn_fun"]]
+        params["max_spawn"] = spawner["max_spawn"]
+        params["spawn_cooldown"] = spawner["spawn_cooldown"]
+
+        entity = Spawner(params)
+        entity.ai.last_spawn_time = spawner["last_spawn_time"]
+    else:
+        entity = Entity(params)
+
+    if "last_seen" in state and state["last_seen"]:
+        entity.ai.last_seen = tuple(state["last_seen"])
+
+    entity.id = state["id"]
+    entity.hp = state["hp"]
+    entity.x, entity.y = state["x"], state["y"]
+    entity.turn_done = state["turn_done"]
+
+    return entity
+
+# Copies everything a snapshot needs out of the world. This is the only part
+# that has to run on the game loop: the copy can be written out from another
+# thread while the world moves on.
+def capture(world):
+    if world.chunks:
+        raise ValueError("chunked worlds can't be snapshotted")
+
+    rng_version, rng_state, rng_gauss = world.random.getstate()
+
+    meta = {
+        "time": world.time,
+        "seed": world.seed,
+        "next_id": next(Entity.ids),
+        "random": [rng_version, rng_state, rng_gauss],
+        "tile_types": [save_tile(tile) for tile in world.tile_types],
+        "entities": [save_entity(world, entity) for entity in world.entities
+                     if type(entity.ai) in AI_TYPES.values()],
+        "waiting": [entity.id for entity in world.waiting]
+    }
+
+    return world.width, world.height, bytes(world.tiles), \
+        bytes(world.glyph_masks), meta
+
+# Writes a captured world, replacing the previous snapshot only once the new
+# one is complete.
+def write(path, captured):
+    width, height, tiles, glyph_masks, meta = captured
+
+    temp_path = f"{path}.tmp"
+
+    with open(temp_path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, width, height))
+        file.write(tiles)
+        file.write(glyph_masks)
+        file.write(zlib.compress(json.dumps(meta).encode()))
+
+    os.replace(temp_path, path)
+
+def save(world, path):
+    write(path, capture(world))
+
+# Replaces the contents of the world with the snapshot, in place, since the
+# world is shared by reference. Players are restored as well, for replaying the
+# turn log on top; a server that has nobody connected yet removes them after.
+def load(world, path):
+    with open(path, "rb") as file:
+        # Private mapping: edits to the map stay in memory.
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    magic, version, width, height = HEADER.unpack_from(data)
+
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a version {VERSION} world snapshot")
+
+    view = memoryview(data)
+    size = width * height
+    tiles_start = HEADER.size
+    masks_start = tiles_start + size
+
+    meta = json.loads(zlib.decompress(view[masks_start + size:]))
+
+    for entity in list(world.entities):
+        world.remove_entity(entity)
+
+    world.width, world.height = width, height
+    world.tiles = view[tiles_start:masks_start]
+    world.glyph_masks = view[masks_start:masks_start + size]
+    world.tile_types = [load_tile(state) for state in meta["tile_types"]]
+    world.appearances = {}
+    world.regions = None
+    world.version += 1
+    world.flow_field = None
+
+    world.time = meta["time"]
+    world.waiting = []
+    world.sleeping = set()
+    world.queued_turns = {}
+    world.pending = []
+
+    rng_version, rng_state, rng_gauss = meta["random"]
+    world.seed = meta["seed"]
+    world.random.setstate((rng_version, tuple(rng_state), rng_gauss))
+
+    Entity.ids = itertools.count(max(next(Entity.ids), meta["next_id"]))
+
+    entities = {}
+
+    for state in meta["entities"]:
+        entity = load_entity(state)
+        world.add_entity(entity)
+
+        entities[entity.id] = (entity, state)
+
+    # Due turns are taken in the order they were scheduled, so restore that.
+    scheduled = sorted((state["next_turn"], state["turn_ticket"], entity.id)
+                       for entity, state in entities.values()
+                       if state["turn_ticket"] is not None)
+
+    world.scheduler = Scheduler()
+
+    for next_turn, ticket, id in scheduled:
+        world.scheduler.schedule(entities[id][0], next_turn)
+
+    world.waiting = [entities[id][0] for id in meta["waiting"]]
+
+    # Whoever takes turns but is neither scheduled nor waiting was asleep.
+    world.sleeping = {entity for entity, state in entities.values()
+                      if entity.speed and state["turn_ticket"] is None
+                      and entity.id not in meta["waiting"]}
+
+    for entity, state in entities.values():
+        entity.next_turn = state["next_turn"]
+
+        if "queued_move" in state:
+            entity.turn_done = False
+            entity.queue_move(*state["queued_move"])
+
+        if "path" in state:
+            entity.ai.queued_path = collections.deque(tuple(cell)
+                                                      for cell in state["path"])
+            entity.ai.path_goal = tuple(state["path_goal"])
+            entity.ai.path_version = world.version
+
+        if "spawner" in state:
+            for id in state["spawner"]["spawned"]:
+                if id in entities:
+                    entity.ai.adopt(entities[id][0])
@@ -0,0 +1,70 @@
+class SpatialIndex:
+    def __init__(self, bucket_size=8):
+        self.bucket_size = bucket_size
+
+        # Exact cell -> entities, for point queries.
+        self.cells = {}
+        # Coarse bucket -> entities, for radius queries.
+        self.buckets = {}
+
+    def __bucket(self, x, y):
+        return x // self.bucket_size, y // self.bucket_size
+
+    def __insert(self, entity, x, y):
+        self.cells.setdefault((x, y), []).append(entity)
+        self.buckets.setdefault(self.__bucket(x, y), []).append(entity)
+
+    def __discard(self, entity, x, y):
+        cell = self.cells.get((x, y))
+
+        if not cell or entity not in cell:
+            return False
+
+        cell.remove(entity)
+
+        if not cell:
+            del self.cells[x, y]
+
+        bucket_key = self.__bucket(x, y)
+        bucket = self.buckets[bucket_key]
+        bucket.remove(entity)
+
+        if not bucket:
+            del self.buckets[bucket_key]
+
+        return True
+
+    def add(self, entity):
+        self.__insert(entity, entity.x, entity.y)
+
+    def remove(self, entity):
+        self.__discard(entity, entity.x, entity.y)
+
+    # Updates the entity's coordinates, keeping the index in sync if the entity
+    # is already indexed.
+    def move(self, entity, x, y):
+        if self.__discard(entity, entity.x, entity.y):
+            self.__insert(entity, x, y)
+
+        entity.x, entity.y = x, y
+
+    def at(self, x, y):
+        return list(self.cells.get((x, y), ()))
+
+    def in_radius(self, x, y, radius):
+        found = []
+
+        min_bx, min_by = self.__bucket(x - radius, y - radius)
+        max_bx, max_by = self.__bucket(x + radius, y + radius)
+
+        r2 = radius * radius
+
+        for by in range(min_by, max_by + 1):
+            for bx in range(min_bx, max_bx + 1):
+                for entity in self.buckets.get((bx, by), ()):
+                    dx, dy = entity.x - x, entity.y - y
+
+                    if dx*dx + dy*dy <= r2:
+                        found.append(entity)
+
+        return found
@@ -1,5 +1,8 @@
 const display = [];
 
+// Size of a cell on the canvas in pixels, as last drawn.
+const cellSize = [0, 0];
+
 function draw(data) {
     const gameElement = document.getElementById("game");
 
@@ -27,6 +30,9 @@ function draw(data) {
 
     const w = Math.ceil(ctx.measureText("@").width);
 
+    cellSize[0] = w;
+    cellSize[1] = h;
+
     ctx.textBaseline = "top";
 
     for (const [y, row] of display.entries()) {
@@ -50,7 +56,12 @@ function dieToString(die) {
     return `${die.count}d${die.sides}${die.inc < 0 ? "-" : "+"}${die.inc}`
 }
 
+// The player as of the last update, in world coordinates.
+let player = null;
+
 function update(data) {
+    player = data.player;
+
     const statusElement = document.getElementById("status");
     statusElement.textContent = "";
 
@@ -76,7 +87,7 @@ function update(data) {
 
     const turnIndicator = document.createElement("div");
     turnIndicator.style.fontSize = "10px";
-    turnIndicator.textContent = `Waiting for ${data.player.turn_done ? "others" : "you"}`
+    turnIndicator.textContent = data.player.turn_done ? "Waiting for your turn" : "Waiting for you"
 
     statusElement.appendChild(turnIndicator);
 
@@ -85,6 +96,119 @@ function update(data) {
 
 window.onresize = function(e) { draw() };
 
+// Last known viewport for the delta protocol. Entities are kept in world
+// coordinates, and translated into the viewport when rendering.
+const view = {
+    origin: [0, 0],
+    tiles: [],
+    entities: new Map(),
+    player: null,
+    // Set while waiting for a keyframe asked for, patches until then are
+    // dropped.
+    stale: false
+};
+
+function renderView() {
+    const [ox, oy] = view.origin;
+
+    const entities = [];
+
+    for (const entity of view.entities.values()) {
+        entities.push({...entity, x: entity.x - ox, y: entity.y - oy});
+    }
+
+    update({
+        tiles: view.tiles,
+        entities: entities,
+        player: view.player
+    });
+}
+
+function keyframe(data) {
+    view.stale = false;
+    view.origin = data.origin;
+    view.tiles = data.tiles;
+    view.entities = new Map(data.entities.map(entity => [entity.id, entity]));
+    view.player = data.player;
+
+    renderView();
+}
+
+function scrollView(origin) {
+    const [dx, dy] = [origin[0] - view.origin[0], origin[1] - view.origin[1]];
+    const old = view.tiles;
+
+    // Cells scrolled in from outside are always part of the patch.
+    view.tiles = old.map((row, y) => row.map((tile, x) => {
+        const oldRow = old[y + dy];
+        return (oldRow && oldRow[x + dx]) || {};
+    }));
+
+    view.origin = origin;
+}
+
+// Asks for the whole viewport again, once, e.g. after missing a patch.
+function requestKeyframe() {
+    if (!view.stale) {
+        view.stale = true;
+        respond("keyframe");
+    }
+}
+
+// Whether the patch only refers to cells and entities we know about. One that
+// doesn't means we lost track, and applying it would only make it worse.
+function canPatch(data) {
+    const size = view.tiles.length;
+    const inView = (x, y) => x >= 0 && y >= 0 && x < size && y < size;
+
+    return size > 0
+        && (data.tiles || []).every(([x, y]) => inView(x, y))
+        && (data.moved || []).every(([id]) => view.entities.has(id))
+        && (data.hp || []).every(([id]) => view.entities.has(id));
+}
+
+function patch(data) {
+    if (view.stale) {
+        return;
+    }
+
+    if (!canPatch(data)) {
+        return requestKeyframe();
+    }
+
+    if (data.origin) {
+        scrollView(data.origin);
+    }
+
+    for (const [x, y, tile] of data.tiles || []) {
+        view.tiles[y][x] = tile;
+    }
+
+    for (const entity of data.spawned || []) {
+        view.entities.set(entity.id, entity);
+    }
+
+    for (const [id, x, y] of data.moved || []) {
+        const entity = view.entities.get(id);
+        entity.x = x;
+        entity.y = y;
+    }
+
+    for (const [id, hp] of data.hp || []) {
+        view.entities.get(id).hp = hp;
+    }
+
+    for (const id of data.removed || []) {
+        view.entities.delete(id);
+    }
+
+    if (data.player) {
+        view.player = data.player;
+    }
+
+    renderView();
+}
+
 function displayMessage(data) {
     const messagesElement = document.getElementById("messages");
 
@@ -95,12 +219,65 @@ function displayMessage(data) {
     messagesElement.scrollTop = messagesElement.scrollHeight;
 }
 
+// Tile appearances referenced by index from binary frames.
+const palette = [];
+
+function updatePalette(data) {
+    for (const [i, entry] of data.entries.entries()) {
+        palette[data.start + i] = entry;
+    }
+}
+
+const FRAME_VIEWPORT = 1;
+
+function decodeFrame(buffer) {
+    const frame = new DataView(buffer);
+
+    if (frame.getUint8(0) != FRAME_VIEWPORT) {
+        return;
+    }
+
+    // Header: type (u8), origin x (i32), origin y (i32), size (u16),
+    // RLE length (u32). Runs are a count (u8) and a palette index (u16).
+    const size = frame.getUint16(9, true);
+    const runsLength = frame.getUint32(11, true);
+    const runsEnd = 15 + runsLength;
+
+    const tiles = [];
+    let row = [];
+
+    for (let offset = 15; offset < runsEnd; offset += 3) {
+        const count = frame.getUint8(offset);
+        const tile = palette[frame.getUint16(offset + 1, true)];
+
+        for (let i = 0; i < count; i++) {
+            row.push(tile);
+
+            if (row.length == size) {
+                tiles.push(row);
+                row = [];
+            }
+        }
+    }
+
+    const tail = new TextDecoder().decode(new Uint8Array(buffer, runsEnd));
+
+    update({tiles: tiles, ...JSON.parse(tail)});
+}
+
 const handlers = {
     update: update,
+    keyframe: keyframe,
+    patch: patch,
+    palette: updatePalette,
     message: displayMessage
 };
 
-const socket = new WebSocket(`ws://${window.location.host}/server/`);
+// Seconds to wait before reconnecting a dropped socket.
+const RECONNECT_DELAY = 2;
+
+let socket = null;
+let connected = false;
 
 function respond(event, data="") {
     socket.send(JSON.stringify({
@@ -116,26 +293,47 @@ function turn(type, data) {
     });
 }
 
-socket.onopen = function(e) {
-    respond("auth", {
-        name: document.getElementById("name").value
-    });
-}
+function connect() {
+    socket = new WebSocket(`ws://${window.location.host}/server/`);
+    socket.binaryType = "arraybuffer";
 
-socket.onclose = function(e) {
-    displayMessage({sender: e.code, text: "disconnected"});
-}
+    socket.onopen = function(e) {
+        respond("auth", {
+            name: document.getElementById("name").value,
+            protocol: document.getElementById("protocol").value
+        });
 
-socket.onmessage = function(e) {
-    const response = JSON.parse(e.data);
+        // Whatever we had is from before the connection dropped.
+        if (connected) {
+            view.stale = false;
+            requestKeyframe();
+        }
 
-    const event = response.e;
+        connected = true;
+    }
 
-    if (event in handlers) {
-        handlers[event](response.d);
+    socket.onclose = function(e) {
+        displayMessage({sender: e.code, text: "disconnected"});
+        setTimeout(connect, RECONNECT_DELAY * 1000);
+    }
+
+    socket.onmessage = function(e) {
+        if (e.data instanceof ArrayBuffer) {
+            return decodeFrame(e.data);
+        }
+
+        const response = JSON.parse(e.data);
+
+        const event = response.e;
+
+        if (event in handlers) {
+            handlers[event](response.d);
+        }
     }
 }
 
+connect();
+
 function move(dx, dy) {
     turn("move", {
         dx: dx,
@@ -143,6 +341,22 @@ function move(dx, dy) {
     });
 }
 
+// Clicking a cell walks there over as many turns as it takes, without
+// sending a move for every step.
+document.getElementById("game").addEventListener("click", event => {
+    if (!player || !cellSize[0]) {
+        return;
+    }
+
+    const x = Math.floor(event.offsetX / cellSize[0]);
+    const y = Math.floor(event.offsetY / cellSize[1]);
+
+    turn("travel", {
+        x: player.x - player.view_radius + x,
+        y: player.y - player.view_radius + y
+    });
+});
+
 const inputField = document.getElementById("chatInput");
 
 inputField.addEventListener("keydown", event => {
@@ -0,0 +1,115 @@
+import numpy as np
+
+from .ai import ControlledAI
+
+MONSTERS = 0
+PLAYERS = 1
+
+# The entities of a world as NumPy columns, one row per entity, so that
+# questions about all of them at once run as array operations. Entities keep
+# their own attributes for everything that looks at one of them at a time; the
+# store mirrors the ones it holds and is kept in sync by the world.
+class EntityStore:
+    def __init__(self, capacity=256):
+        # Rows past `size' have never been used. Rows of removed entities are
+        # reused before growing.
+        self.size = 0
+        self.free = []
+        self.entities = [None] * capacity
+
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.x = np.zeros(capacity, dtype=np.int32)
+        self.y = np.zeros(capacity, dtype=np.int32)
+        self.hp = np.zeros(capacity, dtype=np.int32)
+        self.view_radius = np.zeros(capacity, dtype=np.int32)
+        self.faction = np.zeros(capacity, dtype=np.int8)
+
+    def __len__(self):
+        return self.size - len(self.free)
+
+    def __grow(self):
+        capacity = len(self.entities) * 2
+
+        self.entities.extend([None] * (capacity - len(self.entities)))
+
+        for column in ("alive", "x", "y", "hp", "view_radius", "faction"):
+            old = getattr(self, column)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, column, new)
+
+    def add(self, entity):
+        if self.free:
+            row = self.free.pop()
+        else:
+            if self.size == len(self.entities):
+                self.__grow()
+
+            row = self.size
+            self.size += 1
+
+        self.entities[row] = entity
+        self.alive[row] = True
+        self.x[row] = entity.x
+        self.y[row] = entity.y
+        self.hp[row] = entity.hp
+        self.view_radius[row] = entity.view_radius
+        self.faction[row] = PLAYERS if isinstance(entity.ai, ControlledAI) \
+            else MONSTERS
+
+        entity.row = row
+
+    def remove(self, entity):
+        if entity.row is None:
+            return
+
+        self.entities[entity.row] = None
+        self.alive[entity.row] = False
+        self.free.append(entity.row)
+
+        entity.row = None
+
+    def move(self, entity, x, y):
+        if entity.row is not None:
+            self.x[entity.row] = x
+            self.y[entity.row] = y
+
+    def set_hp(self, entity):
+        if entity.row is not None:
+            self.hp[entity.row] = entity.hp
+
+    # Squared distances from every entity in `rows' to every one in `others'.
+    def distances(self, rows, others):
+        dx = self.x[others][None, :] - self.x[rows][:, None]
+        dy = self.y[others][None, :] - self.y[rows][:, None]
+
+        return dx * dx + dy * dy
+
+    # Maps the row of each given entity to the entities of the other faction
+    # within its view radius, closest first. Whether they are actually in
+    # sight is left to the caller, which only needs to check until one is.
+    def find_enemies(self, entities):
+        found = {}
+
+        rows = np.array([entity.row for entity in entities if entity.row is not None],
+                        dtype=np.intp)
+        live = np.flatnonzero(self.alive[:self.size])
+
+        for faction in np.unique(self.faction[rows]):
+            seekers = rows[self.faction[rows] == faction]
+            enemies = live[self.faction[live] != faction]
+
+            if not len(enemies):
+                continue
+
+            dist = self.distances(seekers, enemies)
+            radius = self.view_radius[seekers][:, None]
+            in_range = dist <= radius * radius
+            order = np.argsort(np.where(in_range, dist, np.iinfo(dist.dtype).max),
+                               axis=1, kind="stable")
+
+            for i, row in enumerate(seekers):
+                closest = order[i][in_range[i][order[i]]]
+                found[row] = [self.entities[j] for j in enemies[closest]]
+
+        return found
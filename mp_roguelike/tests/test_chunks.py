@@ -0,0 +1,82 @@
+import os
+import tempfile
+
+import numpy as np
+
+from django.test import SimpleTestCase
+
+from ..chunks import CHUNK_SIZE
+from ..mapgen import GENERATIONS, run_cellular_automata
+from ..tiles import Floor
+from ..world import World
+
+# Not a whole number of chunks either way, so some are cut off by the edge.
+WIDTH, HEIGHT = 3 * CHUNK_SIZE + 10, 2 * CHUNK_SIZE + 5
+
+class ChunkMapTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        self.world = World(0, 0, 5)
+        self.world.enable_chunks(WIDTH, HEIGHT, directory=directory.name)
+        self.chunks = self.world.chunks
+
+    def tiles(self):
+        return np.array([[self.world.get_tile_id_at(x, y) for x in range(WIDTH)]
+                         for y in range(HEIGHT)])
+
+    # What generating the whole map at once from the chunks' noise gives.
+    def generate_whole(self):
+        columns = -(-WIDTH // CHUNK_SIZE)
+        rows = -(-HEIGHT // CHUNK_SIZE)
+
+        noise = np.block([[self.chunks.noise(cx, cy) for cx in range(columns)]
+                          for cy in range(rows)])
+
+        walls = noise[:HEIGHT, :WIDTH].copy()
+        walls[[0, -1], :] = True
+        walls[:, [0, -1]] = True
+
+        for i in range(GENERATIONS):
+            walls = run_cellular_automata(walls)
+
+        return np.where(walls, self.chunks.wall, self.chunks.floor)
+
+    def test_chunks_fit_together_without_seams(self):
+        np.testing.assert_array_equal(self.tiles(), self.generate_whole())
+
+    def test_chunks_come_out_the_same_in_any_order(self):
+        expected = self.tiles()
+
+        # From the other end this time, after forgetting every chunk.
+        self.chunks.chunks.clear()
+        self.chunks.last_used.clear()
+
+        for y in reversed(range(HEIGHT)):
+            for x in reversed(range(WIDTH)):
+                self.assertEqual(self.world.get_tile_id_at(x, y), expected[y, x],
+                                 f"({x}, {y})")
+
+    def test_changed_tiles_outlive_eviction(self):
+        expected = self.tiles()
+        floor = Floor("#123456")
+
+        self.world.set_tile(40, 20, floor)
+        expected[20, 40] = self.world.get_tile_id_at(40, 20)
+
+        # Let every chunk go, as if nobody had been near them since.
+        self.chunks.time += 1
+        self.chunks.evict(len(self.chunks.chunks))
+
+        self.assertEqual(self.chunks.chunks, {})
+
+        tile = self.world.get_tile_at(40, 20)
+
+        self.assertIs(type(tile), Floor)
+        self.assertEqual(tile.background, "#123456")
+        np.testing.assert_array_equal(self.tiles(), expected)
+
+        # Only the changed chunk was written out; the rest are made anew.
+        cx, cy = 40 // CHUNK_SIZE, 20 // CHUNK_SIZE
+        self.assertEqual(os.listdir(self.chunks.directory), [f"{cx}_{cy}"])
@@ -0,0 +1,65 @@
+from django.test import SimpleTestCase
+
+from ..fov import compute_fov
+from ..tiles import Floor, Wall
+from ..world import World, spawn_player
+
+# An open room of floor, walled in, with nothing else in it.
+def make_room(size=21):
+    world = World(size, size, 0)
+    floor = world.register_tile(Floor("black"))
+    world.tiles = bytearray([floor] * (size * size))
+
+    wall = Wall("gray", "black")
+
+    for i in range(size):
+        for x, y in ((i, 0), (i, size - 1), (0, i), (size - 1, i)):
+            world.set_tile(x, y, wall)
+
+    return world
+
+class ShadowcastingTests(SimpleTestCase):
+    def test_open_room_is_a_disc(self):
+        world = make_room()
+        visible = compute_fov(world, 10, 10, 5)
+
+        disc = {(10 + dx, 10 + dy)
+                for dy in range(-5, 6) for dx in range(-5, 6)
+                if dx * dx + dy * dy <= 25}
+
+        self.assertEqual(visible, disc)
+
+    def test_walls_cast_shadows(self):
+        world = make_room()
+        world.set_tile(12, 10, Wall("gray", "black"))
+
+        visible = compute_fov(world, 10, 10, 8)
+
+        # The wall itself is seen, but not what's right behind it.
+        self.assertIn((12, 10), visible)
+        self.assertNotIn((13, 10), visible)
+        self.assertNotIn((16, 10), visible)
+
+        # The shadow doesn't reach past the wall's edges.
+        self.assertIn((16, 14), visible)
+        self.assertIn((10, 16), visible)
+
+    def test_sees_the_room_walls_and_nothing_past_them(self):
+        world = make_room()
+        visible = compute_fov(world, 2, 2, 10)
+
+        self.assertIn((0, 2), visible)
+        self.assertIn((2, 0), visible)
+        self.assertFalse(any(x < 0 or y < 0 for x, y in visible))
+
+    def test_fov_follows_map_changes(self):
+        world = make_room()
+        player = spawn_player("player", "red")
+        player.x, player.y = 10, 10
+        world.add_entity(player)
+
+        self.assertTrue(player.can_see(14, 10))
+
+        world.set_tile(12, 10, Wall("gray", "black"))
+
+        self.assertFalse(player.can_see(14, 10))
@@ -0,0 +1,114 @@
+import random
+
+from django.test import SimpleTestCase
+
+from ..protocol import DeltaView
+from ..world import World, spawn_player
+
+# What the client does with each frame, see `static/mp_roguelike/game.js'.
+def apply_frame(client, event, data):
+    if event == "keyframe":
+        client.update(origin=data["origin"], tiles=data["tiles"],
+                      entities={other["id"]: other for other in data["entities"]},
+                      player=data["player"])
+        return
+
+    if "origin" in data:
+        dx = data["origin"][0] - client["origin"][0]
+        dy = data["origin"][1] - client["origin"][1]
+
+        old = client["tiles"]
+        size = len(old)
+
+        client["origin"] = data["origin"]
+        client["tiles"] = [[old[y + dy][x + dx]
+                            if 0 <= y + dy < size and 0 <= x + dx < size else None
+                            for x in range(size)]
+                           for y in range(size)]
+
+    for x, y, tile in data.get("tiles", []):
+        client["tiles"][y][x] = tile
+
+    entities = client["entities"]
+
+    for other in data.get("spawned", []):
+        entities[other["id"]] = other
+
+    for id, x, y in data.get("moved", []):
+        entities[id] = {**entities[id], "x": x, "y": y}
+
+    for id, hp in data.get("hp", []):
+        entities[id] = {**entities[id], "hp": hp}
+
+    for id in data.get("removed", []):
+        del entities[id]
+
+    if "player" in data:
+        client["player"] = data["player"]
+
+# Patches only keep up what the client draws other entities with.
+def drawn(entity):
+    return {key: entity[key] for key in DRAWN}
+
+DRAWN = ("name", "character", "color", "background", "x", "y", "hp")
+
+class DeltaViewTests(SimpleTestCase):
+    def setUp(self):
+        self.world = World(60, 60, 1)
+        self.world.generate()
+        self.players = []
+
+        for i in range(3):
+            self.join()
+
+    def join(self):
+        player = spawn_player(f"player{len(self.players)}", "red")
+        self.world.add_entity(player)
+        self.players.append(player)
+
+        return player
+
+    def test_patches_reproduce_full_frames(self):
+        rng = random.Random(1)
+        view = DeltaView()
+        player = self.players[0]
+        client = {}
+
+        for tick in range(200):
+            for other in self.players:
+                if other.world:
+                    other.ai.move(rng.randint(-1, 1), rng.randint(-1, 1))
+
+            self.world.update()
+
+            # Followed into the next life, which starts with a new keyframe.
+            if not player.world:
+                player = self.join()
+                view.reset()
+
+            for event, data in view.encode(player):
+                apply_frame(client, event, data)
+
+            entities = {other.id: drawn(other.stripped())
+                        for other in player.get_visible_entities()}
+
+            self.assertEqual(client["origin"], [player.x - player.view_radius,
+                                                player.y - player.view_radius])
+            self.assertEqual(client["tiles"], player.get_visible_tiles())
+            self.assertEqual({id: drawn(other)
+                              for id, other in client["entities"].items()},
+                             entities)
+            self.assertEqual(client["player"], player.stripped())
+
+    def test_unchanged_view_sends_nothing(self):
+        view = DeltaView()
+        player = self.players[0]
+
+        self.assertEqual([event for event, data in view.encode(player)],
+                         ["keyframe"])
+        self.assertEqual(view.encode(player), [])
+
+        view.reset()
+
+        self.assertEqual([event for event, data in view.encode(player)],
+                         ["keyframe"])
@@ -0,0 +1,157 @@
+import random
+
+import numpy as np
+
+from django.test import SimpleTestCase
+
+from ..pathfinding import find_path, NEIGHBOURS
+from ..regions import Regions, label_regions
+from ..tiles import Floor, Wall
+from ..world import World
+
+# The regions of a map, found the slow and obvious way: as sets of cells, each
+# flood filled in eight directions from a cell no other region has.
+def flood_fill(passable):
+    height, width = passable.shape
+    seen = set()
+    regions = set()
+
+    for y in range(height):
+        for x in range(width):
+            if not passable[y, x] or (x, y) in seen:
+                continue
+
+            region = {(x, y)}
+            stack = [(x, y)]
+
+            while stack:
+                cx, cy = stack.pop()
+
+                for dx, dy in NEIGHBOURS:
+                    nx, ny = cx + dx, cy + dy
+
+                    if 0 <= nx < width and 0 <= ny < height \
+                       and passable[ny, nx] and (nx, ny) not in region:
+                        region.add((nx, ny))
+                        stack.append((nx, ny))
+
+            seen |= region
+            regions.add(frozenset(region))
+
+    return regions
+
+# The same, from labels and their sizes.
+def labelled_regions(test, labels, sizes):
+    height, width = labels.shape
+    regions = {}
+
+    for y in range(height):
+        for x in range(width):
+            if labels[y, x]:
+                regions.setdefault(int(labels[y, x]), set()).add((x, y))
+
+    for label, region in regions.items():
+        test.assertEqual(sizes[label], len(region), f"size of {label}")
+
+    return {frozenset(region) for region in regions.values()}
+
+def random_map(rng, width, height, density):
+    return np.array([[rng.random() < density for x in range(width)]
+                     for y in range(height)])
+
+class RegionsTests(SimpleTestCase):
+    def test_labels_match_a_flood_fill(self):
+        rng = random.Random(1)
+
+        for width, height in ((1, 1), (1, 12), (12, 1), (20, 15), (40, 40)):
+            for density in (0.0, 0.3, 0.5, 0.6, 1.0):
+                passable = random_map(rng, width, height, density)
+                labels, sizes = label_regions(passable)
+
+                self.assertEqual(labelled_regions(self, labels, sizes),
+                                 flood_fill(passable),
+                                 f"{width}x{height} at {density}")
+
+    def test_opening_and_closing_cells_matches_a_flood_fill(self):
+        rng = random.Random(2)
+        passable = random_map(rng, 30, 20, 0.55)
+        regions = Regions(passable)
+
+        for step in range(400):
+            x, y = rng.randrange(30), rng.randrange(20)
+
+            if passable[y, x]:
+                passable[y, x] = False
+                regions.close(x, y)
+            else:
+                passable[y, x] = True
+                regions.open(x, y)
+
+            labels = regions.labels.reshape(20, 30)
+
+            self.assertEqual(labelled_regions(self, labels, regions.sizes),
+                             flood_fill(passable), f"step {step}")
+
+    def test_random_cells_are_in_the_largest_region(self):
+        rng = random.Random(3)
+        passable = random_map(rng, 30, 20, 0.55)
+        regions = Regions(passable)
+
+        for step in range(200):
+            x, y = rng.randrange(30), rng.randrange(20)
+
+            if passable[y, x]:
+                passable[y, x] = False
+                regions.close(x, y)
+            else:
+                passable[y, x] = True
+                regions.open(x, y)
+
+            found = flood_fill(passable)
+            largest = max(len(region) for region in found)
+
+            i = regions.random_cell(rng)
+            region = next((region for region in found
+                           if (i % 30, i // 30) in region), ())
+
+            self.assertEqual(len(region), largest, f"step {step}")
+
+    def test_random_cell_of_a_map_without_floor(self):
+        regions = Regions(np.zeros((5, 5), dtype=bool))
+
+        self.assertIsNone(regions.random_cell(random.Random(4)))
+
+class PathRegionTests(SimpleTestCase):
+    # A room of floor split in two halves by a wall down the middle.
+    def setUp(self):
+        self.world = World(41, 21, 0)
+        floor = self.world.register_tile(Floor("black"))
+        self.world.tiles = bytearray([floor] * (41 * 21))
+
+        for y in range(21):
+            self.world.set_tile(20, y, Wall("gray", "black"))
+
+    def test_goals_in_another_region_are_rejected_without_searching(self):
+        world = self.world
+        self.assertNotEqual(world.get_region(5, 10), world.get_region(35, 10))
+
+        checked = []
+        is_occupied = world.is_occupied
+
+        def counting_is_occupied(x, y):
+            checked.append((x, y))
+            return is_occupied(x, y)
+
+        world.is_occupied = counting_is_occupied
+
+        self.assertIsNone(find_path(world, (5, 10), (35, 10)))
+        # Only the goal itself was looked at.
+        self.assertEqual(checked, [(35, 10)])
+
+    def test_opening_the_wall_joins_the_regions(self):
+        world = self.world
+        world.get_region(0, 0)
+        world.set_tile(20, 10, Floor("black"))
+
+        self.assertEqual(world.get_region(5, 10), world.get_region(35, 10))
+        self.assertEqual(len(find_path(world, (5, 10), (35, 10))), 30)
@@ -0,0 +1,196 @@
+from django.test import SimpleTestCase
+
+from ..sharding import Layout, ShardWorker, Ghost, shard_channel, HALO
+from ..scheduler import PLAYER_TURN_TIMEOUT
+from ..tiles import Tile
+from ..world import spawn_goblin
+
+SESSION = "frontend.1"
+
+# Two shards side by side, passing messages to each other directly instead of
+# through a channel layer.
+class ShardingTests(SimpleTestCase):
+    def setUp(self):
+        self.layout = Layout(60, 30, 2, 1)
+        self.workers = [ShardWorker(index, self.layout, 1)
+                        for index in range(self.layout.count)]
+        # Messages for anyone other than a shard, i.e. the frontends.
+        self.sent = []
+
+        # A free cell on either side of the border, for crossing it.
+        self.border = self.layout.region(1)[0]
+        world = self.workers[0].world
+
+        self.row = next(y for y in range(self.layout.height)
+                        if not world.is_occupied(self.border - 1, y)
+                        and not world.is_occupied(self.border, y))
+
+    def deliver(self):
+        for worker in self.workers:
+            outbox, worker.outbox = worker.outbox, []
+
+            for is_group, target, message in outbox:
+                for other in self.workers:
+                    if target == other.channel:
+                        other.inbox.append(message)
+                        break
+                else:
+                    self.sent.append((target, message))
+
+    # Messages sent on one tick are handled on the next.
+    def tick(self, count=1):
+        for i in range(count):
+            for worker in self.workers:
+                worker.tick()
+
+            self.deliver()
+
+    def send(self, index, message):
+        self.workers[index].inbox.append({"session": SESSION, **message})
+
+    def find(self, index, id):
+        for entity in self.workers[index].world.entities:
+            if entity.id == id:
+                return entity
+
+    # Joins a player on the first shard, right at the border with the second.
+    def join(self):
+        first = self.workers[0]
+        first.on_join({"session": SESSION, "name": "player", "protocol": None})
+
+        player = first.sessions[SESSION].player.entity
+        player.set_position(self.border - 1, self.row)
+
+        return player
+
+    def cross(self):
+        self.send(0, {"type": "shard.intent",
+                      "turn": {"turn_type": "move", "data": {"dx": 1, "dy": 0}}})
+
+        for i in range(20):
+            self.tick()
+
+            if SESSION in self.workers[1].sessions:
+                return
+
+        self.fail("player wasn't handed off")
+
+    def test_player_is_handed_off_across_the_border(self):
+        first, second = self.workers
+        player = self.join()
+        self.cross()
+
+        self.assertNotIn(SESSION, first.sessions)
+        self.assertEqual(first.handed_off, {SESSION: 1})
+        self.assertIn((SESSION, {"type": "shard.routed", "shard": 1}), self.sent)
+
+        entity = second.sessions[SESSION].player.entity
+
+        self.assertEqual((entity.id, entity.x, entity.y),
+                         (player.id, self.border, self.row))
+        self.assertEqual(entity.hp, player.hp)
+
+        # Only a ghost of it stays behind.
+        self.tick()
+        self.assertIsInstance(self.find(0, player.id), Ghost)
+
+    def test_late_messages_follow_the_player(self):
+        second = self.workers[1]
+        self.join()
+        self.cross()
+
+        # Sent before the frontend heard about the handoff.
+        self.send(0, {"type": "shard.intent",
+                      "turn": {"turn_type": "move", "data": {"dx": 1, "dy": 0}}})
+        self.tick()
+
+        self.assertEqual([message["type"] for message in second.inbox],
+                         ["shard.intent"])
+
+        self.send(0, {"type": "shard.leave"})
+        self.tick(2)
+
+        for worker in self.workers:
+            self.assertEqual(worker.sessions, {})
+            self.assertEqual(worker.handed_off, {})
+
+    def test_entities_near_the_border_are_mirrored(self):
+        first, second = self.workers
+        player = self.join()
+        self.tick(2)
+
+        ghost = self.find(1, player.id)
+
+        self.assertIsInstance(ghost, Ghost)
+        self.assertEqual((ghost.x, ghost.y), (player.x, player.y))
+
+        # Entities further away than the halo aren't.
+        for entity in first.world.entities:
+            if not isinstance(entity, Ghost) and entity.x < self.border - HALO:
+                self.assertIsNone(self.find(1, entity.id))
+
+        # Damage to a ghost is dealt by its owner.
+        hp = player.hp
+        ghost.attacked_by = Tile("goblin", "g", "green")
+        ghost.damage(3)
+        self.deliver()
+        self.tick(2)
+
+        self.assertEqual(player.hp, hp - 3)
+        self.assertEqual(self.find(1, player.id).hp, hp - 3)
+
+        # Ghosts go away along with the entity.
+        self.send(0, {"type": "shard.leave"})
+        self.tick(2)
+
+        self.assertIsNone(self.find(1, player.id))
+
+    def test_handed_off_monsters_leave_their_spawner(self):
+        first = self.workers[0]
+        spawner = next(entity for entity in first.world.entities
+                       if entity.name == "Goblin Spawner")
+
+        goblin = spawn_goblin()
+        spawner.ai.adopt(goblin)
+        first.world.add_entity(goblin)
+        goblin.set_position(self.border, self.row)
+
+        first.hand_off()
+
+        self.assertNotIn(goblin, first.world.entities)
+        self.assertNotIn(goblin, spawner.ai.spawned)
+        self.assertEqual(first.outbox[-1][1], shard_channel(1))
+
+    def test_travels_are_taken_once_a_turn_to_seen_cells(self):
+        player = self.join()
+        world = self.workers[0].world
+
+        # Let the first turn pass, so that the next is a while off.
+        self.tick(PLAYER_TURN_TIMEOUT + 1)
+
+        seen = next((x, y) for x, y in sorted(player.get_fov())
+                    if (x, y) != (player.x, player.y)
+                    and not world.is_occupied(x, y))
+        unseen = next((x, y) for y in range(world.height)
+                      for x in range(world.width)
+                      if not world.is_occupied(x, y)
+                      and not player.can_see(x, y))
+
+        def travel(x, y):
+            self.send(0, {"type": "shard.intent",
+                          "turn": {"turn_type": "travel",
+                                   "data": {"x": x, "y": y}}})
+
+        travel(*unseen)
+        travel(*seen)
+        travel(*seen)
+        self.tick(3)
+
+        self.assertGreater(player.next_turn, world.time)
+
+        session = self.workers[0].sessions[SESSION]
+
+        # The cell out of sight is ignored, and the second travel to the one
+        # in sight waits for the next turn.
+        self.assertEqual(player.ai.path_goal, seen)
+        self.assertEqual(len(session.intents), 1)
@@ -0,0 +1,70 @@
+import os
+import random
+import tempfile
+
+from django.test import SimpleTestCase
+
+from .. import snapshot
+from ..world import World, spawn_player
+
+# Everything the next tick depends on, in a comparable form. Ids are left out,
+# since those of new entities depend on what else the process made meanwhile.
+def world_state(world):
+    return (world.time, bytes(world.tiles), world.random.getstate(),
+            sorted((entity.name, entity.x, entity.y, entity.hp,
+                    entity.next_turn, entity.turn_done)
+                   for entity in world.entities))
+
+class SnapshotTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        self.path = os.path.join(directory.name, "world.snap")
+
+    def play(self, world, moves, ticks):
+        for i in range(ticks):
+            for entity in world.players:
+                entity.ai.move(moves.randint(-1, 1), moves.randint(-1, 1))
+
+            world.update()
+
+    def test_restored_world_runs_the_same(self):
+        world = World(60, 60, 1)
+        world.generate()
+
+        for i in range(2):
+            world.add_entity(spawn_player(f"player{i}", "red"))
+
+        self.play(world, random.Random(1), 100)
+        snapshot.save(world, self.path)
+
+        states = []
+
+        for i in range(300):
+            self.play(world, random.Random(i), 1)
+            states.append(world_state(world))
+
+        restored = World(10, 10, 2)
+        restored.generate()
+        snapshot.load(restored, self.path)
+
+        for i in range(300):
+            self.play(restored, random.Random(i), 1)
+            self.assertEqual(world_state(restored), states[i], f"tick {i}")
+
+    def test_load_replaces_the_world(self):
+        world = World(30, 20, 1)
+        world.generate()
+        snapshot.save(world, self.path)
+
+        other = World(50, 50, 2)
+        other.generate()
+        other.add_entity(spawn_player("player", "red"))
+        snapshot.load(other, self.path)
+
+        self.assertEqual(world_state(other), world_state(world))
+        self.assertEqual({entity.id for entity in other.entities},
+                         {entity.id for entity in world.entities})
+        self.assertEqual(other.get_region(*other.random_position()),
+                         world.get_region(*world.random_position()))
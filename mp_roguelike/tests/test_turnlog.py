@@ -0,0 +1,110 @@
+import json
+import os
+import random
+import tempfile
+
+from django.test import SimpleTestCase
+
+from .. import snapshot, turnlog
+from ..management.commands.replay import digest
+from ..world import World, spawn_player
+
+class TurnLogTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        self.path = os.path.join(directory.name, "turns.log")
+        self.snapshot_path = os.path.join(directory.name, "world.snap")
+
+    # Plays a logged game: players come and go, and move and travel at random.
+    # Returns the digest of the world after every tick.
+    def play(self, world, ticks, snapshot_at=None):
+        world.turn_log = turnlog.TurnLog(self.path, buffer_size=16)
+        world.turn_log.start(world)
+
+        rng = random.Random(1)
+        players = []
+        digests = {}
+
+        for i in range(ticks):
+            if i % 100 == 0 and len(players) < 3:
+                player = spawn_player(f"player{i}", "red")
+                world.add_entity(player)
+                players.append(player)
+
+            if i == 250 and players[0].world:
+                players.pop(0).remove()
+
+            for player in players:
+                if not player.world or rng.random() > 0.3:
+                    continue
+
+                # Not `random_position', which would draw from the world's
+                # RNG, unlike anything a player does.
+                if rng.random() < 0.1:
+                    player.ai.travel(rng.randrange(world.width),
+                                     rng.randrange(world.height))
+                else:
+                    player.ai.move(rng.randint(-1, 1), rng.randint(-1, 1))
+
+            world.update()
+            digests[world.time] = digest(world)
+
+            if i == snapshot_at:
+                snapshot.save(world, self.snapshot_path)
+
+        world.turn_log.close()
+
+        return digests
+
+    def replay(self, world, digests):
+        turnlog.replay(world, turnlog.read(self.path))
+
+        end = max(digests)
+
+        while world.time < end:
+            world.update()
+            self.assertEqual(digest(world), digests[world.time],
+                             f"time {world.time}")
+
+    def test_replay_matches_the_game(self):
+        world = World(60, 60, 1)
+        world.generate()
+
+        digests = self.play(world, 400)
+        records = turnlog.read(self.path)
+
+        self.assertEqual(records[0][1:], ["start", 60, 60, 1, False])
+        self.assertEqual({record[1] for record in records},
+                         {"start", "join", "move", "travel", "leave"})
+
+        self.replay(turnlog.new_world(records), digests)
+
+    def test_replay_from_a_snapshot(self):
+        world = World(60, 60, 1)
+        world.generate()
+
+        digests = self.play(world, 400, snapshot_at=200)
+
+        restored = World(10, 10, 2)
+        snapshot.load(restored, self.snapshot_path)
+
+        self.replay(restored, digests)
+
+    def test_read_stops_at_a_cut_off_record(self):
+        with open(self.path, "w") as file:
+            file.write(json.dumps([0, "start", 10, 10, 1, False]) + "\n")
+            file.write(json.dumps([5, "join", 1, "player", "red"]) + "\n")
+            file.write('[7, "move", 1,')
+
+        self.assertEqual([record[1] for record in turnlog.read(self.path)],
+                         ["start", "join"])
+
+    def test_read_keeps_the_last_timeline(self):
+        with open(self.path, "w") as file:
+            file.write(json.dumps([0, "start", 10, 10, 1, False]) + "\n")
+            file.write(json.dumps([5, "join", 1, "player", "red"]) + "\n")
+            file.write(json.dumps([0, "start", 10, 10, 2, False]) + "\n")
+
+        self.assertEqual(turnlog.read(self.path), [[0, "start", 10, 10, 2, False]])
@@ -1,6 +1,11 @@
 from .util import color
 
 class Tile:
+    __slots__ = ("name", "character", "background", "color")
+
+    impassable = False
+    opaque = False
+
     def __init__(self, name="thin air", character=" ", color="gray", background="black"):
         self.name = name
         self.character = character
@@ -15,63 +20,24 @@ class Tile:
     def fancy_you(self):
         return color(self.color, "You")
 
-    @property
-    def impassable(self):
-        return False
-
-    @property
-    def opaque(self):
-        return False
-
 class Floor(Tile):
+    __slots__ = ()
+
     def __init__(self, color):
         super().__init__(f"{color} floor", " ", "gray", color)
 
 class Wall(Tile):
+    __slots__ = ()
+
+    impassable = True
+    opaque = True
+
     def __init__(self, color, background):
         super().__init__(f"{color} wall", "#", color, background)
 
-    @property
-    def impassable(self):
-        return True
-
-    @property
-    def opaque(self):
-        return True
+    # Box-drawing glyphs indexed by the bitmask of impassable neighbours, as
+    # stored in `World.glyph_masks': 8 - left, 4 - right, 2 - up, 1 - down.
+    glyphs = "○○○║○╔╚╠○╗╝╣═╦╩╬"
 
     def get_fancy_character(self, world, x, y):
-        wall_characters = {
-            "0,0,0,0": "○",
-            "1,0,0,0": "○",
-            "0,1,0,0": "○",
-            "1,1,0,0": "═",
-            "0,0,1,0": "○",
-            "0,0,0,1": "○",
-            "0,0,1,1": "║",
-            "1,0,1,0": "╝",
-            "1,0,0,1": "╗",
-            "0,1,1,0": "╚",
-            "0,1,0,1": "╔",
-            "1,0,1,1": "╣",
-            "0,1,1,1": "╠",
-            "1,1,1,0": "╩",
-            "1,1,0,1": "╦",
-            "1,1,1,1": "╬"
-        }
-
-        positions = [
-            (x - 1, y),
-            (x + 1, y),
-            (x, y - 1),
-            (x, y + 1)
-        ]
-
-        adjacent = []
-
-        for pos in positions:
-            if world.get_tile_at(*pos).impassable:
-                adjacent.append("1")
-            else:
-                adjacent.append("0")
-
-        return wall_characters[",".join(adjacent)]
+        return self.glyphs[world.get_glyph_mask_at(x, y)]
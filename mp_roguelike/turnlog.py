@@ -0,0 +1,132 @@
+import json
+
+from .world import World, spawn_player
+
+# How many records to hold before writing them out, unless flushed sooner.
+BUFFER_SIZE = 256
+
+# An append-only record of everything the players did to a world, one JSON
+# array per line: the world time, the kind of record, then its arguments.
+# Monsters aren't recorded, since with the world's seeded RNG they do the same
+# thing every time given the same players.
+#
+#   [time, "start", width, height, seed, chunked]
+#                                         the log was opened on this world
+#   [time, "join", id, name, color]       a player entity was added
+#   [time, "move", id, dx, dy]            a player moved or attacked
+#   [time, "travel", id, x, y]            a player set off for a cell
+#   [time, "leave", id]                   a player entity was removed
+class TurnLog:
+    def __init__(self, path, buffer_size=BUFFER_SIZE):
+        self.file = open(path, "a")
+        self.buffer = []
+        self.buffer_size = buffer_size
+
+    def record(self, *record):
+        self.buffer.append(json.dumps(record))
+
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def start(self, world):
+        self.record(world.time, "start", world.width, world.height, world.seed,
+                    bool(world.chunks))
+
+    def flush(self):
+        if self.buffer:
+            self.file.write("\n".join(self.buffer) + "\n")
+            self.file.flush()
+
+            self.buffer = []
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+# The records of the world's current timeline. A server restored from a
+# snapshot carries on its timeline, but one that started over from a new world
+# starts a new one, and everything before that is dropped.
+def read(path):
+    records = []
+
+    with open(path) as file:
+        for line in file:
+            # The last line may have been cut short by a crash.
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+
+            if record[1] == "start" and records and record[0] < records[-1][0]:
+                records = []
+
+            records.append(record)
+
+    return records
+
+# Feeds the logged records from the world's current time onwards back into it,
+# stepping the world in between exactly like the game loop did. Returns the
+# number of updates it took. Without a snapshot to start from, pass a world
+# made by `new_world'.
+def replay(world, records):
+    players = {}
+    updates = 0
+
+    for entity in world.players:
+        players[entity.id] = entity
+
+    for record in records:
+        time, kind, *args = record
+
+        if time < world.time:
+            continue
+
+        while world.time < time:
+            world.update()
+            updates += 1
+
+        if kind == "join":
+            id, name, color = args
+
+            entity = spawn_player(name, color)
+            world.add_entity(entity)
+            players[id] = entity
+        elif kind == "move":
+            id, dx, dy = args
+
+            entity = players.get(id)
+
+            if entity and entity.world:
+                entity.ai.move(dx, dy)
+        elif kind == "travel":
+            id, x, y = args
+
+            entity = players.get(id)
+
+            if entity and entity.world:
+                entity.ai.travel(x, y)
+        elif kind == "leave":
+            entity = players.pop(args[0], None)
+
+            # Dead players are already gone.
+            if entity and entity.world:
+                world.remove_entity(entity)
+
+    return updates
+
+# The world the records start on, if it was freshly generated.
+def new_world(records):
+    time, kind, width, height, seed, *chunked = records[0]
+
+    # Logs from before chunked worlds don't say.
+    if chunked and chunked[0]:
+        world = World(0, 0, seed)
+        world.enable_chunks(width, height)
+    else:
+        world = World(width, height, seed)
+        world.generate()
+
+    while world.time < time:
+        world.update()
+
+    return world
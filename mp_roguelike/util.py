@@ -9,18 +9,28 @@ def sign(x):
 def get_param(params, parameter, default=None):
     return params[parameter] if parameter in params else default
 
+# The attributes of an object with `__slots__', base class ones first. Used in
+# place of `__dict__' when serializing.
+def fields(obj):
+    return {name: getattr(obj, name)
+            for cls in reversed(type(obj).__mro__)
+            for name in getattr(cls, "__slots__", ())}
+
 class Die:
+    __slots__ = ("count", "sides", "inc")
+
     def __init__(self, count, sides, inc=0):
         self.count = count
         self.sides = sides
         self.inc = inc
 
-        self.roll = self.__call__
-
-    def __call__(self, ontop=0):
+    # Worlds pass their own `rng', to stay replayable.
+    def __call__(self, ontop=0, rng=random):
         roll = 0
 
         for i in range(self.count):
-            roll += random.randint(1, self.sides + 1)
+            roll += rng.randint(1, self.sides + 1)
 
         return roll + self.inc + ontop
+
+    roll = __call__
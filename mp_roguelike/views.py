@@ -1,6 +1,16 @@
+from django.http import HttpResponse
 from django.shortcuts import render
 
+from .metrics import metrics
+
 def index(request):
     return render(request, "mp_roguelike/index.html", {
-        "name": request.GET.get("name", "")
+        "name": request.GET.get("name", ""),
+        "protocol": request.GET.get("protocol", "delta")
     })
+
+# Scraped by Prometheus. Only meaningful when served by the process running the
+# game loop, i.e. through the ASGI application.
+def metrics_view(request):
+    return HttpResponse(metrics.render(),
+                        content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -1,34 +1,253 @@
+import numpy as np
 import random
-
-from .event import Sender
-from .util import Die
-
+import time
+
+from .event import Sender, LocalSender
+from .metrics import metrics
+from .util import Die, fields
+
+from .spatial import SpatialIndex
+from .store import EntityStore
+from .scheduler import Scheduler, turn_delay, PLAYER_TURN_TIMEOUT
+from .mapgen import WALL_CHANCE, GENERATIONS, run_cellular_automata
+from .regions import Regions
+from .chunks import ChunkMap, GlyphMasks, CHUNK_SIZE, CHUNK_BUDGET
+from .pathfinding import FlowField
 from .tiles import Tile, Floor, Wall
 from .entities import Entity, Spawner
+from .ai import ControlledAI
+
+# How many steps away from the players monsters can follow the flow field.
+FLOW_FIELD_RADIUS = 16
+
+# Entities further than this from every player are asleep and don't think.
+ACTIVE_RADIUS = 24
+
+# Spawners placed in every chunk of a chunked world, about as many per cell as
+# a flat one gets.
+SPAWNERS_PER_CHUNK = 2
+
+# Players in a chunked world start this close to the middle of the map.
+SPAWN_RADIUS = 16
+
+def spawn_goblin():
+    return Entity({
+        "name": "Goblin",
+        "character": "g",
+        "color": "darkgreen",
+        "hp_roll": Die(1, 3, +4),
+        "attack_roll": Die(1, 4, -1),
+        "view_radius": 6
+    })
+
+def spawn_player(name, color):
+    return Entity({
+        "name": name,
+        "character": "@",
+        "color": color,
+        "ai_type": ControlledAI,
+        "hp_roll": Die(3, 8, +40),
+        "attack_roll": Die(2, 6, +2),
+        "view_radius": 10
+    })
+
+def spawn_spawner():
+    return Spawner({
+        "name": "Goblin Spawner",
+        "character": "*",
+        "color": "brown",
+        "spawn_fun": spawn_goblin
+    })
+
+# Spawners refer to what they spawn by name in snapshots.
+SPAWN_FUNS = {fun.__name__: fun for fun in [spawn_goblin]}
 
 class World:
-    def __init__(self, width, height):
+    def __init__(self, width, height, seed=None):
         self.width = width
         self.height = height
-        self.tiles = []
+
+        # Every random decision in the world is drawn from here, so a world is
+        # replayed exactly from its seed and the inputs in its turn log.
+        if seed is None:
+            seed = random.SystemRandom().getrandbits(32)
+
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.turn_log = None
+        self.tiles = bytearray(width * height)
+        self.tile_types = [Tile()]
+        self.glyph_masks = bytearray(width * height)
+        # Stands in for the grids above once chunked, see `enable_chunks'.
+        self.chunks = None
+        # The connected region of every cell. See `update_regions'.
+        self.regions = None
+        # Rendered wall appearances keyed by (tile id, glyph mask).
+        self.appearances = {}
+        # Bumped whenever the map changes, invalidating cached FOVs.
+        self.version = 0
+
         self.entities = []
-        self.queued_turns = []
+        self.players = []
+        self.index = SpatialIndex()
+        # Optional columnar copy of the entities, see `enable_store'.
+        self.store = None
+
+        self.active_radius = ACTIVE_RADIUS
+        # Ticks since the world was created.
+        self.time = 0
+        self.scheduler = Scheduler()
+        # Players whose turn came but who haven't picked an action yet.
+        self.waiting = []
+        # Entities that came due far from every player. They stay off the
+        # scheduler until a player comes near, see `wake_up'.
+        self.sleeping = set()
+        # Distances to the players, shared by monsters until a player moves or
+        # the map changes, which is what `flow_field_key' tells.
+        self.flow_field = None
+        self.flow_field_key = None
+        # Entities taking their turn this update, and the enemies each of them
+        # could see, looked up for all of them at once.
+        self.due = []
+        self.enemies = None
+        # Entity -> the action it will take on its turn.
+        self.queued_turns = {}
+        # Called at the start of the next update, see `later'.
+        self.pending = []
+
+        # Cells whose contents changed since the last `flush_changes'.
+        self.changes = set()
 
         self.updated = Sender()
-        self.entity_died = Sender()
+        self.changed = Sender()
+        # Only heard by the entities that see it happen.
+        self.entity_died = LocalSender(self.index)
+
+    # Tiles are flyweights: the grid stores a single byte per cell, which
+    # indexes into `tile_types'.
+    def register_tile(self, tile):
+        for tile_id, other in enumerate(self.tile_types):
+            if type(other) is type(tile) and fields(other) == fields(tile):
+                return tile_id
+
+        if len(self.tile_types) > 255:
+            raise ValueError("too many tile types")
+
+        self.tile_types.append(tile)
+        return len(self.tile_types) - 1
+
+    def get_tile_id_at(self, x, y):
+        return self.tiles[y * self.width + x] if self.is_in_bounds(x, y) else 0
 
     def get_tile_at(self, x, y):
-        return self.tiles[y][x] if self.is_in_bounds(x, y) else Tile()
+        return self.tile_types[self.get_tile_id_at(x, y)]
 
     def set_tile(self, x, y, tile):
         if self.is_in_bounds(x, y):
-            self.tiles[y][x] = tile
+            changed = self.is_impassable(x, y) != tile.impassable
+
+            self.tiles[y * self.width + x] = self.register_tile(tile)
+
+            if changed and self.regions:
+                if tile.impassable:
+                    self.regions.close(x, y)
+                else:
+                    self.regions.open(x, y)
+            self.version += 1
+            self.mark_changed(x, y)
+
+            for dy in range(-1, 2):
+                for dx in range(-1, 2):
+                    self.__update_glyph_mask(x + dx, y + dy)
+
+    def get_glyph_mask_at(self, x, y):
+        if self.is_in_bounds(x, y):
+            return self.glyph_masks[y * self.width + x]
+        return 0
+
+    def __update_glyph_mask(self, x, y):
+        if self.is_in_bounds(x, y):
+            self.glyph_masks[y * self.width + x] = \
+                self.is_impassable(x - 1, y) << 3 \
+                | self.is_impassable(x + 1, y) << 2 \
+                | self.is_impassable(x, y - 1) << 1 \
+                | self.is_impassable(x, y + 1)
+
+    def update_glyph_masks(self):
+        impassable = np.array([tile.impassable for tile in self.tile_types],
+                              dtype=np.uint8)
+        tiles = np.frombuffer(self.tiles, dtype=np.uint8)
+
+        # Out of bounds cells are thin air, which is passable.
+        padded = np.pad(impassable[tiles].reshape(self.height, self.width), 1)
+
+        masks = padded[1:-1, :-2] << 3 \
+            | padded[1:-1, 2:] << 2 \
+            | padded[:-2, 1:-1] << 1 \
+            | padded[2:, 1:-1]
+
+        self.glyph_masks = bytearray(masks)
+
+    # Labels the connected regions of the map from scratch. `set_tile' keeps
+    # them up to date from then on. Chunked worlds are never labelled, since
+    # they are never whole.
+    def update_regions(self):
+        if self.chunks:
+            self.regions = None
+            return
+
+        impassable = np.array([tile.impassable for tile in self.tile_types])
+        tiles = np.frombuffer(self.tiles, dtype=np.uint8)
+        passable = ~impassable[tiles].reshape(self.height, self.width)
+
+        self.regions = Regions(passable)
+
+    # The label of the region the cell belongs to, the same for any two cells
+    # that can reach each other. Zero for impassable cells, and for every cell
+    # of a chunked world, where it isn't known.
+    def get_region(self, x, y):
+        if self.chunks or not self.is_in_bounds(x, y):
+            return 0
+
+        if self.regions is None:
+            self.update_regions()
+
+        return self.regions.label_at(x, y)
+
+    def get_appearance_at(self, x, y):
+        if not self.is_in_bounds(x, y):
+            return self.tile_types[0]
+
+        i = y * self.width + x
+        tile_id = self.tiles[i]
+        tile = self.tile_types[tile_id]
+
+        if not isinstance(tile, Wall):
+            return tile
+
+        key = (tile_id, self.glyph_masks[i])
+        appearance = self.appearances.get(key)
+
+        if appearance is None:
+            appearance = {**fields(tile), "character": tile.glyphs[key[1]]}
+            self.appearances[key] = appearance
+
+        return appearance
+
+    def is_impassable(self, x, y):
+        return self.tile_types[self.get_tile_id_at(x, y)].impassable
+
+    def is_opaque(self, x, y):
+        return self.tile_types[self.get_tile_id_at(x, y)].opaque
 
     def get_entities_at(self, x, y):
         if self.is_in_bounds(x, y):
-            return [entity for entity in self.entities if entity.is_at(x, y)]
+            return self.index.at(x, y)
         return []
 
+    def get_entities_in_radius(self, x, y, radius):
+        return self.index.in_radius(x, y, radius)
+
     def is_on_border(self, x, y):
         return x == 0 or y == 0 or x == self.width - 1 or y == self.height - 1
 
@@ -36,28 +255,169 @@ class World:
         return x >= 0 and y >= 0 and x < self.width and y < self.height
 
     def is_occupied(self, x, y):
-        return not self.is_in_bounds(x, y) or self.get_tile_at(x, y).impassable
+        if not self.is_in_bounds(x, y):
+            return True
+
+        return self.tile_types[self.tiles[y * self.width + x]].impassable
+
+    def mark_changed(self, x, y):
+        self.changes.add((x, y))
+
+    def flush_changes(self):
+        if not self.changes:
+            return False
+
+        changes, self.changes = self.changes, set()
+        self.changed(changes)
+
+        return True
 
     def add_entity(self, entity):
         entity.on_add(self)
         self.entities.append(entity)
+        self.index.add(entity)
+
+        if self.store:
+            self.store.add(entity)
+
+        if isinstance(entity.ai, ControlledAI):
+            self.players.append(entity)
+
+            if self.turn_log:
+                self.turn_log.record(self.time, "join", entity.id, entity.name,
+                                     entity.color)
+        self.mark_changed(entity.x, entity.y)
+
+        # Entities without speed never take turns.
+        if entity.speed:
+            self.scheduler.schedule(entity, self.time + 1)
 
     def remove_entity(self, entity):
+        self.mark_changed(entity.x, entity.y)
+        self.index.remove(entity)
+
+        if self.store:
+            self.store.remove(entity)
+
         entity.on_remove()
         self.entities.remove(entity)
 
+        if entity in self.players:
+            self.players.remove(entity)
+
+            if self.turn_log:
+                self.turn_log.record(self.time, "leave", entity.id)
+
+        self.scheduler.unschedule(entity)
+        self.queued_turns.pop(entity, None)
+        self.entity_died.unsubscribe(entity)
+
+        if entity in self.waiting:
+            self.waiting.remove(entity)
+
+        self.sleeping.discard(entity)
+
+    def move_entity(self, entity, x, y):
+        self.mark_changed(entity.x, entity.y)
+        self.mark_changed(x, y)
+        self.index.move(entity, x, y)
+
+        if self.store:
+            self.store.move(entity, x, y)
+
+    # Keeps the entities in an `EntityStore' as well, which lets monsters pick
+    # their targets in one batch per update.
+    def enable_store(self):
+        if self.store:
+            return
+
+        self.store = EntityStore()
+
+        for entity in self.entities:
+            self.store.add(entity)
+
+    # Swaps the tile grid for a `ChunkMap' of the given size and generates it
+    # anew, in place, since the world is shared by reference. Chunks are only
+    # generated once players come near them.
+    def enable_chunks(self, width, height, budget=CHUNK_BUDGET, directory=None):
+        for entity in list(self.entities):
+            self.remove_entity(entity)
+
+        self.width, self.height = width, height
+
+        # Far enough to cover what the active entities around players can see.
+        radius = self.active_radius + CHUNK_SIZE
+        self.chunks = ChunkMap(width, height, radius, budget, directory)
+        self.tiles = self.chunks
+        self.glyph_masks = GlyphMasks(self)
+
+        self.generate(self.seed)
+
+    # Places a chunk's spawners the first time players come near it.
+    def populate_chunk(self, cx, cy):
+        rng = self.chunks.rng(cx, cy)
+
+        for x, y in rng.integers(CHUNK_SIZE, size=(SPAWNERS_PER_CHUNK, 2)):
+            x, y = cx * CHUNK_SIZE + int(x), cy * CHUNK_SIZE + int(y)
+
+            if not self.is_occupied(x, y):
+                spawner = spawn_spawner()
+                spawner.x, spawner.y = x, y
+
+                self.add_entity(spawner)
+
+    # Where entities dropped in at random go: a free cell of the largest
+    # region. A chunked world keeps them near the middle instead, rather than
+    # generating chunks all over the map.
+    def random_position(self):
+        if self.chunks:
+            x0, y0 = self.width // 2 - SPAWN_RADIUS, self.height // 2 - SPAWN_RADIUS
+            cells = [(x, y)
+                     for y in range(y0, y0 + 2 * SPAWN_RADIUS + 1)
+                     for x in range(x0, x0 + 2 * SPAWN_RADIUS + 1)
+                     if not self.is_occupied(x, y)]
+
+            return self.random.choice(cells)
+
+        if self.regions is None:
+            self.update_regions()
+
+        i = self.regions.random_cell(self.random)
+
+        if i is None:
+            raise IndexError("No passable cells to place entities in")
+
+        return i % self.width, i // self.width
+
+    # Enemies within the entity's view radius, closest first, but not
+    # necessarily in sight. Requires the store.
+    def get_enemy_candidates(self, entity):
+        if self.enemies is None:
+            self.enemies = self.store.find_enemies(self.due)
+
+        if entity.row not in self.enemies:
+            self.enemies.update(self.store.find_enemies([entity]))
+
+        return self.enemies.get(entity.row, [])
+
     def get_visible_entities(self, around):
         visible = []
 
-        for other in self.entities:
-            if around.can_see(other.x, other.y):
+        fov = around.get_fov()
+        candidates = self.index.in_radius(around.x, around.y, around.view_radius)
+
+        for other in candidates:
+            if (other.x, other.y) in fov:
                 visible.append(other)
 
         return visible
 
-    def get_renderable(self, entity):
+    def get_visible_tiles(self, entity):
         tiles = []
 
+        air = self.tile_types[0]
+        fov = entity.get_fov()
+
         for y in range(-entity.view_radius, entity.view_radius + 1):
             y += entity.y
 
@@ -66,21 +426,17 @@ class World:
             for x in range(-entity.view_radius, entity.view_radius + 1):
                 x += entity.x
 
-                if entity.can_see(x, y):
-                    tile = self.get_tile_at(x, y)
-
-                    if isinstance(tile, Wall):
-                        tile = {
-                            **tile.__dict__,
-                            "character": tile.get_fancy_character(self, x, y)
-                        }
-
-                    row.append(tile)
+                if (x, y) in fov:
+                    row.append(self.get_appearance_at(x, y))
                 else:
-                    row.append(Tile())
+                    row.append(air)
 
             tiles.append(row)
 
+        return tiles
+
+    def get_renderable(self, entity):
+        tiles = self.get_visible_tiles(entity)
         entities = entity.get_visible_entities()
 
         for i, other in enumerate(entities):
@@ -93,92 +449,161 @@ class World:
 
         return tiles, entities
 
+    def get_flow_field(self):
+        goals = [(player.x, player.y) for player in self.players]
+        key = (goals, self.version)
+
+        if self.flow_field is None or key != self.flow_field_key:
+            started = time.perf_counter()
+
+            self.flow_field = FlowField(self, goals, FLOW_FIELD_RADIUS)
+            self.flow_field_key = key
+
+            metrics.observe("flow_field", time.perf_counter() - started)
+
+        return self.flow_field
+
+    # Runs `fun' between updates rather than in the middle of one, which is
+    # where the turn log can replay it from.
+    def later(self, fun):
+        self.pending.append(fun)
+
     def queue_turn(self, turn):
         if not turn.entity.turn_done:
-            self.queued_turns.append(turn)
+            self.queued_turns[turn.entity] = turn
         turn.entity.turn_done = True
 
-    def update(self):
-        for entity in self.entities:
+    def is_player(self, entity):
+        return isinstance(entity.ai, ControlledAI)
+
+    # Entities within `active_radius' of a player. Everyone else sleeps.
+    def find_active(self):
+        active = set()
+
+        for player in self.players:
+            active.update(self.index.in_radius(player.x, player.y,
+                                               self.active_radius))
+
+        return active
+
+    # Puts the sleepers a player came near back on the scheduler, due now.
+    def wake_up(self, active):
+        woken = sorted((entity for entity in active if entity in self.sleeping),
+                       key=lambda entity: entity.id)
+
+        for entity in woken:
+            self.sleeping.remove(entity)
+            self.scheduler.schedule(entity, self.time)
+
+        metrics.count("entities_woken", len(woken))
+
+    # Lets a due entity act. Players get until their deadline to pick an
+    # action, and pass if they don't; returns False while still waiting.
+    def take_turn(self, entity):
+        if entity not in self.queued_turns:
+            started = time.perf_counter()
             entity.ai.think()
+            metrics.observe("think", time.perf_counter() - started)
 
-        for entity in self.entities:
-            if not entity.turn_done:
-                return
+        turn = self.queued_turns.pop(entity, None)
+        player = self.is_player(entity)
+
+        if turn is None and player \
+           and self.time - entity.next_turn < PLAYER_TURN_TIMEOUT:
+            return False
 
-        for turn in self.queued_turns:
+        if turn:
+            started = time.perf_counter()
             turn.do()
-            turn.entity.turn_done = False
+            metrics.observe("turn", time.perf_counter() - started)
 
-        self.queued_turns = []
+        entity.turn_done = False
 
-        self.updated()
+        if entity.world is self:
+            self.scheduler.schedule(entity, self.time + turn_delay(entity.speed))
 
-    def __count_walls(self, x, y):
-        to_check = [
-            (x - 1, y - 1),
-            (x, y - 1),
-            (x + 1, y - 1),
-            (x - 1, y),
-            (x, y),
-            (x + 1, y),
-            (x - 1, y + 1),
-            (x, y + 1),
-            (x + 1, y + 1)
-        ]
+            # The player's own view shows whose turn it is.
+            if player:
+                self.mark_changed(entity.x, entity.y)
+
+        return True
 
-        walls_count = 0
+    # Advances the world by one tick. Only the entities whose turn has come
+    # are touched, so idle players and far away monsters cost nothing.
+    def update(self):
+        pending, self.pending = self.pending, []
+
+        for fun in pending:
+            fun()
+
+        if self.chunks:
+            for cx, cy in self.chunks.stream(self.time, self.players):
+                self.populate_chunk(cx, cy)
+
+        self.enemies = None
+        self.time += 1
+
+        active = self.find_active()
+        self.wake_up(active)
+
+        waiting, self.waiting = self.waiting, []
+        self.due = waiting + self.scheduler.pop_due(self.time)
+
+        metrics.count("entities_due", len(self.due))
 
-        for coords in to_check:
-            if isinstance(self.get_tile_at(*coords), Wall):
-                walls_count += 1
+        for entity in self.due:
+            if entity.world is not self:
+                continue
 
-        return walls_count
+            if entity not in active:
+                self.sleeping.add(entity)
+                metrics.count("entities_slept")
+            elif not self.take_turn(entity):
+                self.waiting.append(entity)
 
-    def __run_cellular_automata(self):
-        for y, row in enumerate(self.tiles):
-            for x, tile in enumerate(row):
-                if self.__count_walls(x, y) > 5:
-                    self.set_tile(x, y, Wall(self.fg, self.bg))
+        self.due = []
 
-    def generate(self):
-        self.tiles = []
+        started = time.perf_counter()
+        self.updated()
+        metrics.observe("updated", time.perf_counter() - started)
+
+    def generate(self, seed=None):
+        if seed is not None:
+            self.seed = seed
+            self.random.seed(seed)
+
+        rng = np.random.default_rng(self.random.getrandbits(64))
+
+        self.tile_types = [Tile()]
+        self.appearances = {}
+        self.version += 1
 
-        self.fg, self.bg = random.choice([
+        palettes = [
             ("gray", "#303030")
-        ])
+        ]
 
-        for y in range(self.height):
-            self.tiles.append([])
+        self.fg, self.bg = palettes[rng.integers(len(palettes))]
 
-            for x in range(self.width):
-                if self.is_on_border(x, y) or random.random() <= 0.4:
-                    tile = Wall(self.fg, self.bg)
-                else:
-                    tile = Floor(self.bg)
+        wall = self.register_tile(Wall(self.fg, self.bg))
+        floor = self.register_tile(Floor(self.bg))
+
+        if self.chunks:
+            self.chunks.reset(int(rng.integers(1 << 63)), wall, floor)
+            return
 
-                self.tiles[y].append(tile)
+        walls = rng.random((self.height, self.width)) <= WALL_CHANCE
+        walls[[0, -1], :] = True
+        walls[:, [0, -1]] = True
 
-        for i in range(4):
-            self.__run_cellular_automata()
+        for i in range(GENERATIONS):
+            walls = run_cellular_automata(walls)
 
-        def spawn_goblin():
-            return Entity({
-                "name": "Goblin",
-                "character": "g",
-                "color": "darkgreen",
-                "hp_roll": Die(1, 3, +4),
-                "attack_roll": Die(1, 4, -1),
-                "view_radius": 6
-            })
+        self.tiles = bytearray(np.where(walls, wall, floor).astype(np.uint8))
+        self.update_glyph_masks()
+        self.update_regions()
 
         for i in range(20):
-            self.add_entity(Spawner({
-                "name": "Goblin Spawner",
-                "character": "*",
-                "color": "brown",
-                "spawn_fun": spawn_goblin
-            }))
+            self.add_entity(spawn_spawner())
 
 world = World(100, 100)
 world.generate()